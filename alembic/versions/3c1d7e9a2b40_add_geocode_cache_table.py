@@ -0,0 +1,32 @@
+"""Add geocode_cache table
+
+Revision ID: 3c1d7e9a2b40
+Revises: a140ee79e0e1
+Create Date: 2026-10-18 09:12:41.317562
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3c1d7e9a2b40'
+down_revision: Union[str, None] = 'a140ee79e0e1'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('geocode_cache',
+    sa.Column('query', sa.String(), nullable=False),
+    sa.Column('latitude', sa.Float(), nullable=True),
+    sa.Column('longitude', sa.Float(), nullable=True),
+    sa.Column('expires_at', sa.DateTime(timezone=True), nullable=False),
+    sa.PrimaryKeyConstraint('query')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('geocode_cache')
@@ -0,0 +1,31 @@
+"""Add worker_leases table
+
+Revision ID: 5e8f2a6c1d93
+Revises: 3c1d7e9a2b40
+Create Date: 2026-10-18 10:03:27.845190
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5e8f2a6c1d93'
+down_revision: Union[str, None] = '3c1d7e9a2b40'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('worker_leases',
+    sa.Column('name', sa.String(), nullable=False),
+    sa.Column('holder', sa.String(), nullable=False),
+    sa.Column('expires_at', sa.DateTime(timezone=True), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('worker_leases')
@@ -0,0 +1,26 @@
+"""Add completed_at to worker_leases
+
+Revision ID: 7a4b9d3e6f21
+Revises: 5e8f2a6c1d93
+Create Date: 2026-10-18 11:20:54.602118
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7a4b9d3e6f21'
+down_revision: Union[str, None] = '5e8f2a6c1d93'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('worker_leases', sa.Column('completed_at', sa.DateTime(timezone=True), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('worker_leases', 'completed_at')
@@ -0,0 +1,27 @@
+"""Add owm_city_id to favorite_locations
+
+Revision ID: b2d6e4f81a57
+Revises: 7a4b9d3e6f21
+Create Date: 2026-10-18 13:05:12.408331
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b2d6e4f81a57'
+down_revision: Union[str, None] = '7a4b9d3e6f21'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Left empty here; filled in by the app the first time each favorite is displayed
+    op.add_column('favorite_locations', sa.Column('owm_city_id', sa.Integer(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('favorite_locations', 'owm_city_id')
@@ -0,0 +1,62 @@
+"""Make favorite location coordinates numeric and add a geohash index
+
+Revision ID: c4e1a9b7d352
+Revises: b2d6e4f81a57
+Create Date: 2026-10-18 13:48:37.915204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from app import geo
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c4e1a9b7d352'
+down_revision: Union[str, None] = 'b2d6e4f81a57'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table('favorite_locations') as batch_op:
+        batch_op.alter_column('latitude', existing_type=sa.String(), type_=sa.Float(),
+                              postgresql_using="NULLIF(latitude, '')::double precision")
+        batch_op.alter_column('longitude', existing_type=sa.String(), type_=sa.Float(),
+                              postgresql_using="NULLIF(longitude, '')::double precision")
+        batch_op.add_column(sa.Column('geohash', sa.String(length=12), nullable=True))
+        batch_op.create_index('ix_favorite_locations_geohash', ['geohash'], unique=False)
+
+    # Backfill the geohash of existing locations
+    favorite_locations = sa.table(
+        'favorite_locations',
+        sa.column('id', sa.Integer()),
+        sa.column('latitude', sa.Float()),
+        sa.column('longitude', sa.Float()),
+        sa.column('geohash', sa.String()),
+    )
+    connection = op.get_bind()
+    rows = connection.execute(sa.select(
+        favorite_locations.c.id, favorite_locations.c.latitude, favorite_locations.c.longitude
+    ).where(
+        favorite_locations.c.latitude.isnot(None),
+        favorite_locations.c.longitude.isnot(None)
+    )).all()
+    if rows:
+        connection.execute(
+            favorite_locations.update().where(favorite_locations.c.id == sa.bindparam('location_id'))
+            .values(geohash=sa.bindparam('location_geohash')),
+            [{'location_id': row.id, 'location_geohash': geo.encode(row.latitude, row.longitude)} for row in rows]
+        )
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('favorite_locations') as batch_op:
+        batch_op.drop_index('ix_favorite_locations_geohash')
+        batch_op.drop_column('geohash')
+        batch_op.alter_column('longitude', existing_type=sa.Float(), type_=sa.String(),
+                              postgresql_using='longitude::varchar')
+        batch_op.alter_column('latitude', existing_type=sa.Float(), type_=sa.String(),
+                              postgresql_using='latitude::varchar')
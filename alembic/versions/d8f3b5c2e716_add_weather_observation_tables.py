@@ -0,0 +1,61 @@
+"""Add weather observation tables
+
+Revision ID: d8f3b5c2e716
+Revises: c4e1a9b7d352
+Create Date: 2026-10-18 14:36:02.771950
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd8f3b5c2e716'
+down_revision: Union[str, None] = 'c4e1a9b7d352'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+ROLLUP_TABLES = ('weather_observations_hourly', 'weather_observations_daily')
+
+
+def upgrade() -> None:
+    op.create_table(
+        'weather_observations',
+        sa.Column('cell', sa.String(length=12), nullable=False),
+        sa.Column('observed_at', sa.BigInteger(), nullable=False),
+        sa.Column('latitude', sa.Float(), nullable=False),
+        sa.Column('longitude', sa.Float(), nullable=False),
+        sa.Column('temperature', sa.Float(), nullable=False),
+        sa.Column('humidity', sa.Integer(), nullable=False),
+        sa.Column('wind_speed', sa.Float(), nullable=False),
+        sa.Column('condition', sa.String(), nullable=False),
+        sa.Column('description', sa.String(), nullable=False),
+        sa.PrimaryKeyConstraint('cell', 'observed_at')
+    )
+    op.create_index(op.f('ix_weather_observations_observed_at'), 'weather_observations', ['observed_at'], unique=False)
+
+    for table in ROLLUP_TABLES:
+        op.create_table(
+            table,
+            sa.Column('cell', sa.String(length=12), nullable=False),
+            sa.Column('bucket_start', sa.BigInteger(), nullable=False),
+            sa.Column('samples', sa.Integer(), nullable=False),
+            sa.Column('temperature_min', sa.Float(), nullable=False),
+            sa.Column('temperature_max', sa.Float(), nullable=False),
+            sa.Column('temperature_sum', sa.Float(), nullable=False),
+            sa.Column('humidity_sum', sa.Float(), nullable=False),
+            sa.Column('wind_speed_max', sa.Float(), nullable=False),
+            sa.Column('wind_speed_sum', sa.Float(), nullable=False),
+            sa.PrimaryKeyConstraint('cell', 'bucket_start')
+        )
+        op.create_index(op.f(f'ix_{table}_bucket_start'), table, ['bucket_start'], unique=False)
+
+
+def downgrade() -> None:
+    for table in reversed(ROLLUP_TABLES):
+        op.drop_index(op.f(f'ix_{table}_bucket_start'), table_name=table)
+        op.drop_table(table)
+    op.drop_index(op.f('ix_weather_observations_observed_at'), table_name='weather_observations')
+    op.drop_table('weather_observations')
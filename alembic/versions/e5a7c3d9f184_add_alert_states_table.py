@@ -0,0 +1,37 @@
+"""Add alert states table
+
+Revision ID: e5a7c3d9f184
+Revises: d8f3b5c2e716
+Create Date: 2026-10-18 15:52:41.308164
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e5a7c3d9f184'
+down_revision: Union[str, None] = 'd8f3b5c2e716'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'alert_states',
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('location_id', sa.Integer(), nullable=False),
+        sa.Column('fingerprint', sa.String(length=64), nullable=False),
+        sa.Column('alerts', sa.Text(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(timezone=True), nullable=False),
+        sa.Column('notified_at', sa.DateTime(timezone=True), nullable=False),
+        sa.ForeignKeyConstraint(['location_id'], ['favorite_locations.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('user_id', 'location_id')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('alert_states')
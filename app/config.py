@@ -1,6 +1,9 @@
 from dotenv import load_dotenv
+from pydantic import model_validator
 from pydantic_settings import BaseSettings
 
+from app import geo
+
 # Load environment variables from .env file
 load_dotenv()
 
@@ -8,14 +11,82 @@ load_dotenv()
 class Settings(BaseSettings):
     API_KEY: str  # API key for external service
     DATABASE_URL: str  # Database connection URL
+    ASYNC_DATABASE_URL: str = ""  # Async driver URL; derived from DATABASE_URL (asyncpg/aiosqlite) when empty
+    DB_POOL_SIZE: int = 10  # Connections kept open in the database pool of each process
+    DB_MAX_OVERFLOW: int = 10  # Extra connections opened beyond DB_POOL_SIZE under load
+    DB_POOL_TIMEOUT: float = 30.0  # Seconds a request waits for a free pool connection before failing
+    DB_POOL_RECYCLE: int = 1800  # Seconds after which a pooled connection is replaced; -1 disables
+    DB_POOL_PRE_PING: bool = True  # Test pooled connections before use so dropped connections are replaced
+    DB_SLOW_STATEMENT_SECONDS: float = 0.5  # Statements slower than this are logged
     SECRET_KEY: str  # Secret key for cryptographic operations
     ALGORITHM: str  # Algorithm used for JWT token encoding
     ACCESS_TOKEN_EXPIRE_MINUTES: int  # Token expiration time in minutes
+    TOKEN_CACHE_SIZE: int = 10000  # Verified access tokens kept in memory to skip repeated JWT decodes
+    TOKEN_CACHE_TTL: int = 300  # Seconds a verified token is cached, never beyond its expiry
+    PRINCIPAL_CACHE_TTL: int = 60  # Seconds a signed-in user's profile is cached; other processes see changes after this
+    BCRYPT_ROUNDS: int = 12  # bcrypt cost factor; existing hashes are upgraded on the next login when it changes
+    BCRYPT_WORKERS: int = 2  # Threads that hash and verify passwords; keep below the CPU count so pages stay responsive
     EMAIL_FROM: str  # Sender email address for notifications
     SMTP_SERVER: str  # SMTP server address for sending emails
     SMTP_PORT: int  # Port number for the SMTP server
     SMTP_USER: str  # Username for SMTP authentication
     SMTP_PASSWORD: str  # Password for SMTP authentication
+    SMTP_STARTTLS: bool = True  # Upgrade SMTP connections with STARTTLS
+    SMTP_POOL_SIZE: int = 2  # Authenticated SMTP connections kept open for reuse
+    SMTP_TIMEOUT: float = 30.0  # Socket timeout for SMTP connections in seconds
+    SMTP_MAX_RETRIES: int = 3  # Retries for a message after a temporary SMTP failure
+    SMTP_RETRY_BACKOFF: float = 0.5  # Initial delay between SMTP retries in seconds, doubled each retry
+
+    OWM_BASE_URL: str = "http://api.openweathermap.org"  # Base URL of the OpenWeatherMap API
+    OWM_HTTP_MAX_CONNECTIONS: int = 100  # Maximum number of concurrent upstream connections
+    OWM_HTTP_MAX_KEEPALIVE_CONNECTIONS: int = 20  # Idle connections kept open for reuse
+    OWM_HTTP_KEEPALIVE_EXPIRY: float = 30.0  # Seconds an idle connection is kept alive
+    OWM_HTTP_TIMEOUT: float = 10.0  # Read/write/pool timeout for upstream calls in seconds
+    OWM_HTTP_CONNECT_TIMEOUT: float = 5.0  # Connect timeout for upstream calls in seconds
+
+    GEOCODE_CACHE_SIZE: int = 10000  # Maximum number of geocode results kept in memory
+    GEOCODE_CACHE_TTL: int = 30 * 24 * 3600  # Seconds a found city is cached
+    GEOCODE_NEGATIVE_CACHE_TTL: int = 3600  # Seconds a "City not found" result is cached
+
+    WEATHER_CELL_PRECISION: int = 5  # Geohash length (1 to geo.STORED_PRECISION) of the cells sharing cached weather and sweep checks; 5 is about 5 x 5 km
+    WEATHER_CACHE_SIZE: int = 5000  # Maximum number of grid cells kept per weather cache
+    CURRENT_WEATHER_CACHE_TTL: int = 600  # Seconds current conditions are cached
+    FORECAST_CACHE_TTL: int = 1800  # Seconds 5-day forecasts are cached
+    WEATHER_PAGE_BUDGET_SECONDS: float = 3.0  # Seconds the weather page waits for the forecast before rendering without it
+    GZIP_MINIMUM_SIZE: int = 1000  # Responses smaller than this many bytes are not gzip-compressed
+
+    SWEEP_INTERVAL_SECONDS: float = 300  # Seconds between scheduled weather alert sweeps
+    SWEEP_SHARDS: int = 1  # Number of shards the alert sweep's locations are split into
+    SWEEP_MAX_SHARDS_PER_WORKER: int = 1  # Shards a single worker process sweeps at the same time
+    SWEEP_LEASE_TTL: float = 30  # Seconds a worker's shard lease stays valid without a heartbeat
+    SWEEP_LEASE_RENEW_INTERVAL: float = 10  # Seconds between shard lease heartbeats and claim attempts
+    SWEEP_CONCURRENCY: int = 20  # Locations checked concurrently by the alert sweep
+    SWEEP_LOCATION_TIMEOUT: float = 15.0  # Seconds before the sweep gives up on a single location
+    ALERT_RENOTIFY_INTERVAL_SECONDS: float = 6 * 3600  # Seconds before unchanged active alerts are emailed again; 0 never repeats them
+    OBSERVATION_RAW_RETENTION_DAYS: int = 7  # Days sweep observations are kept before being rolled up into hourly buckets
+    OBSERVATION_HOURLY_RETENTION_DAYS: int = 90  # Days hourly buckets are kept before being rolled up into daily buckets
+    OBSERVATION_ROLLUP_INTERVAL_SECONDS: float = 3600  # Seconds between runs of the observation downsampling job
+    EXPORT_BATCH_SIZE: int = 1000  # Rows fetched from the database and encoded per chunk of a history export
+    WORKER_METRICS_HOST: str = "0.0.0.0"  # Interface the worker serves its metrics on
+    WORKER_METRICS_PORT: int = 0  # Port the worker serves its metrics on; 0 disables the metrics server
+
+    @model_validator(mode="after")
+    def check_observation_retention(self) -> "Settings":
+        """
+        Hourly buckets must outlive raw observations, or daily buckets would be rebuilt hour by hour.
+        """
+        if self.OBSERVATION_HOURLY_RETENTION_DAYS < self.OBSERVATION_RAW_RETENTION_DAYS:
+            raise ValueError("OBSERVATION_HOURLY_RETENTION_DAYS must be at least OBSERVATION_RAW_RETENTION_DAYS.")
+        return self
+
+    @model_validator(mode="after")
+    def check_weather_cell_precision(self) -> "Settings":
+        """
+        Weather cells are prefixes of the stored geohashes, so they can be no longer than those.
+        """
+        if not 1 <= self.WEATHER_CELL_PRECISION <= geo.STORED_PRECISION:
+            raise ValueError(f"WEATHER_CELL_PRECISION must be between 1 and {geo.STORED_PRECISION}.")
+        return self
 
     class Config:
         env_file = ".env.py"  # Specify the .env file
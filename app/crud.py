@@ -1,23 +1,34 @@
-from typing import Optional, Type
-from sqlalchemy.orm import Session
-from . import models, schemas
+from datetime import datetime, timedelta, timezone
+from typing import AsyncIterator, Optional, Sequence
+from sqlalchemy import BigInteger, Row, Table, delete, func, insert, literal_column, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from . import geo, models, schemas
 
 
-def get_user(db: Session, user_id: int) -> Optional[models.Users]:
+async def get_user(db: AsyncSession, user_id: int) -> Optional[models.Users]:
     """
     Retrieve a user by their ID from the database.
     """
-    return db.query(models.Users).filter(models.Users.id == user_id).first()
+    return await db.scalar(select(models.Users).where(models.Users.id == user_id))
 
 
-def get_user_by_email(db: Session, email: str) -> Optional[models.Users]:
+async def get_user_by_email(db: AsyncSession, email: str) -> Optional[models.Users]:
     """
     Retrieve a user by their email from the database.
     """
-    return db.query(models.Users).filter(models.Users.email == email).first()
+    return await db.scalar(select(models.Users).where(models.Users.email == email))
 
 
-def create_user(db: Session, user: schemas.UserCreate) -> models.Users:
+async def get_user_by_username(db: AsyncSession, username: str) -> Optional[models.Users]:
+    """
+    Retrieve a user by their username from the database.
+    """
+    return await db.scalar(select(models.Users).where(models.Users.username == username))
+
+
+async def create_user(db: AsyncSession, user: schemas.UserCreate) -> models.Users:
     """
     Create and store a new user in the database.
     """
@@ -29,61 +40,363 @@ def create_user(db: Session, user: schemas.UserCreate) -> models.Users:
         last_name=user.last_name
     )
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await db.refresh(db_user)
     return db_user
 
 
-def get_all_users(db: Session) -> list[Type[models.Users]]:
+async def toggle_auto_check(db: AsyncSession, user_id: int) -> Optional[bool]:
+    """
+    Flip a user's auto_check_enabled flag in one statement and return its new value.
+
+    Turning it off forgets the alerts the user was told about, so that turning it back on during
+    an alert sends a fresh one.
+    """
+    result = await db.execute(update(models.Users).where(models.Users.id == user_id).values(
+        auto_check_enabled=~models.Users.auto_check_enabled
+    ).returning(models.Users.auto_check_enabled))
+    enabled = result.scalar_one_or_none()
+    if enabled is False:
+        await db.execute(delete(models.AlertState).where(models.AlertState.user_id == user_id))
+    await db.commit()
+    return enabled
+
+
+async def toggle_send_alert(db: AsyncSession, location: models.FavoriteLocation) -> bool:
+    """
+    Flip the send_alert flag of a favorite location and return its new value.
+
+    Turning it off forgets the alerts sent for the location, as toggle_auto_check does for a user.
+    """
+    location.send_alert = not location.send_alert
+    if not location.send_alert:
+        await db.execute(delete(models.AlertState).where(models.AlertState.user_id == location.owner_id,
+                                                         models.AlertState.location_id == location.id))
+    await db.commit()
+    return location.send_alert
+
+
+async def get_all_users(db: AsyncSession) -> Sequence[models.Users]:
     """
     Retrieve a list of all users from the database.
     """
-    return db.query(models.Users).all()
+    return (await db.scalars(select(models.Users))).all()
 
 
-def get_users_with_auto_check_enabled(db: Session) -> list[Type[models.Users]]:
+async def get_users_with_auto_check_enabled(db: AsyncSession) -> Sequence[models.Users]:
     """
     Retrieve all users with auto-check enabled.
     """
-    return db.query(models.Users).filter(models.Users.auto_check_enabled == True).all()
+    return (await db.scalars(select(models.Users).where(models.Users.auto_check_enabled == True))).all()
 
 
-def get_favorite_locations(db: Session, user_id: int, send_alert: bool = None) -> list[Type[models.FavoriteLocation]]:
+async def get_favorite_locations(db: AsyncSession, user_id: int,
+                                 send_alert: bool = None) -> Sequence[models.FavoriteLocation]:
     """
     Retrieve a list of favorite locations for a given user, optionally filtering by send_alert.
     """
-    query = db.query(models.FavoriteLocation).filter(models.FavoriteLocation.owner_id == user_id)
+    query = select(models.FavoriteLocation).where(models.FavoriteLocation.owner_id == user_id)
     if send_alert is not None:
-        query = query.filter(models.FavoriteLocation.send_alert == send_alert)
-    return query.all()
+        query = query.where(models.FavoriteLocation.send_alert == send_alert)
+    return (await db.scalars(query)).all()
+
+
+async def get_favorite_location(db: AsyncSession, user_id: int, location_id: int) -> Optional[models.FavoriteLocation]:
+    """
+    Retrieve one of a user's favorite locations by its ID.
+    """
+    return await db.scalar(select(models.FavoriteLocation).where(
+        models.FavoriteLocation.id == location_id,
+        models.FavoriteLocation.owner_id == user_id
+    ))
 
 
+async def get_favorite_location_by_name(db: AsyncSession, user_id: int,
+                                        city_name: str) -> Optional[models.FavoriteLocation]:
+    """
+    Retrieve one of a user's favorite locations by its city name.
+    """
+    return await db.scalar(select(models.FavoriteLocation).where(
+        models.FavoriteLocation.name == city_name,
+        models.FavoriteLocation.owner_id == user_id
+    ).limit(1))
 
 
+async def get_alert_subscriptions(db: AsyncSession) -> Sequence[
+        tuple[models.Users, models.FavoriteLocation, Optional[models.AlertState]]]:
+    """
+    Retrieve every (user, favorite location) pair that should receive weather alerts, with the
+    alert state last recorded for the pair (or None), in a single query.
+    """
+    result = await db.execute(select(models.Users, models.FavoriteLocation, models.AlertState).join(
+        models.FavoriteLocation, models.FavoriteLocation.owner_id == models.Users.id
+    ).outerjoin(models.AlertState, (models.AlertState.user_id == models.Users.id) &
+                (models.AlertState.location_id == models.FavoriteLocation.id)
+    ).where(
+        models.Users.auto_check_enabled == True,
+        models.FavoriteLocation.send_alert == True
+    ))
+    return result.tuples().all()
 
 
-def create_favorite_location(db: Session, user_id: int, city_name: str, latitude: float,
-                             longitude: float) -> models.FavoriteLocation:
+async def create_favorite_location(db: AsyncSession, user_id: int, city_name: str, latitude: float,
+                                   longitude: float, owm_city_id: Optional[int] = None) -> models.FavoriteLocation:
     """
     Create and store a favorite location for a user in the database.
     """
     db_location = models.FavoriteLocation(
         name=city_name,
-        latitude=str(latitude),
-        longitude=str(longitude),
+        latitude=latitude,
+        longitude=longitude,
+        geohash=geo.encode(latitude, longitude),
+        owm_city_id=owm_city_id,
         owner_id=user_id
     )
     db.add(db_location)
-    db.commit()
-    db.refresh(db_location)
+    await db.commit()
+    await db.refresh(db_location)
     return db_location
 
 
-def favorite_location_exists(db: Session, user_id: int, city_name: str) -> bool:
+async def set_owm_city_ids(db: AsyncSession, city_ids: dict[int, int]) -> None:
+    """
+    Record the OpenWeatherMap city ID of several favorite locations, keyed by location ID, in one batch.
+    """
+    if not city_ids:
+        return
+    await db.execute(update(models.FavoriteLocation), [
+        {"id": location_id, "owm_city_id": city_id} for location_id, city_id in city_ids.items()
+    ])
+    await db.commit()
+
+
+async def favorite_location_exists(db: AsyncSession, user_id: int, city_name: str) -> bool:
     """
     Check if a favorite location exists for a user.
     """
-    return db.query(models.FavoriteLocation).filter(
-        models.FavoriteLocation.owner_id == user_id,
-        models.FavoriteLocation.name == city_name
-    ).first() is not None
+    return await get_favorite_location_by_name(db, user_id, city_name) is not None
+
+
+async def get_geocode(db: AsyncSession, query: str) -> Optional[models.GeocodeCache]:
+    """
+    Retrieve an unexpired cached geocoding result for a normalized query.
+    """
+    return await db.scalar(select(models.GeocodeCache).where(
+        models.GeocodeCache.query == query,
+        models.GeocodeCache.expires_at > datetime.now(timezone.utc)
+    ))
+
+
+async def save_geocode(db: AsyncSession, query: str, latitude: Optional[float], longitude: Optional[float],
+                       ttl: int) -> None:
+    """
+    Store or refresh a geocoding result. Pass None coordinates to record a city that was not found.
+
+    A single upsert, so processes resolving the same new query at once do not conflict.
+    """
+    await db.execute(_upsert(db, models.GeocodeCache.__table__, ["query"]).values(
+        query=query,
+        latitude=latitude,
+        longitude=longitude,
+        expires_at=datetime.now(timezone.utc) + timedelta(seconds=ttl)
+    ))
+    await db.commit()
+
+
+async def acquire_lease(db: AsyncSession, name: str, holder: str, ttl: float,
+                        completed_before: Optional[datetime] = None) -> bool:
+    """
+    Acquire or renew a named lease for a holder. Returns False while another holder owns an unexpired lease.
+
+    If completed_before is given, the lease is only acquired when its job has not completed since then.
+    """
+    now = datetime.now(timezone.utc)
+    expires_at = now + timedelta(seconds=ttl)
+
+    statement = update(models.WorkerLease).where(
+        models.WorkerLease.name == name,
+        (models.WorkerLease.holder == holder) | (models.WorkerLease.expires_at <= now)
+    )
+    if completed_before is not None:
+        statement = statement.where(
+            (models.WorkerLease.completed_at == None) | (models.WorkerLease.completed_at <= completed_before)
+        )
+    result = await db.execute(statement.values(holder=holder, expires_at=expires_at))
+    await db.commit()
+    if result.rowcount:
+        return True
+
+    # No lease row yet: the first worker to insert it becomes the holder
+    if await db.scalar(select(models.WorkerLease.name).where(models.WorkerLease.name == name)) is not None:
+        return False
+    try:
+        db.add(models.WorkerLease(name=name, holder=holder, expires_at=expires_at))
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        return False
+    return True
+
+
+async def release_lease(db: AsyncSession, name: str, holder: str, completed: bool = False) -> None:
+    """
+    Give up a named lease so another worker can take it over immediately,
+    optionally recording that its job completed.
+    """
+    now = datetime.now(timezone.utc)
+    values = {"expires_at": now}
+    if completed:
+        values["completed_at"] = now
+    await db.execute(update(models.WorkerLease).where(
+        models.WorkerLease.name == name,
+        models.WorkerLease.holder == holder
+    ).values(**values))
+    await db.commit()
+
+
+def _insert_ignoring_duplicates(db: AsyncSession, table):
+    """
+    INSERT statement that skips rows whose primary key already exists, on the backends that support it.
+    """
+    dialect = db.bind.dialect.name
+    if dialect == "postgresql":
+        return postgresql.insert(table).on_conflict_do_nothing()
+    if dialect == "sqlite":
+        return sqlite.insert(table).on_conflict_do_nothing()
+    return insert(table)
+
+
+def _upsert(db: AsyncSession, table, index_elements: Sequence[str]):
+    """
+    INSERT statement that updates every other column of rows whose key already exists.
+    """
+    dialect = db.bind.dialect.name
+    if dialect == "postgresql":
+        statement = postgresql.insert(table)
+    elif dialect == "sqlite":
+        statement = sqlite.insert(table)
+    else:
+        raise NotImplementedError(f"Upserts are not supported on {dialect}.")
+    return statement.on_conflict_do_update(index_elements=index_elements, set_={
+        column.name: statement.excluded[column.name] for column in table.columns if column.name not in index_elements
+    })
+
+
+ROLLUP_COLUMNS = ["cell", "bucket_start", "samples", "temperature_min", "temperature_max", "temperature_sum",
+                  "humidity_sum", "wind_speed_max", "wind_speed_sum"]
+
+
+def _insert_merging_rollups(db: AsyncSession, table: Table, rows):
+    """
+    INSERT ... SELECT of rollup rows that merges each row into an existing bucket for the same cell
+    and time: samples and sums are added, minimums and maximums combined.
+    """
+    dialect = db.bind.dialect.name
+    if dialect == "postgresql":
+        statement, least, greatest = postgresql.insert(table), func.least, func.greatest
+    elif dialect == "sqlite":
+        # SQLite's min() and max() with several arguments are scalar functions
+        statement, least, greatest = sqlite.insert(table), func.min, func.max
+    else:
+        raise NotImplementedError(f"Upserts are not supported on {dialect}.")
+    statement = statement.from_select(ROLLUP_COLUMNS, rows)
+    excluded = statement.excluded
+    return statement.on_conflict_do_update(index_elements=["cell", "bucket_start"], set_={
+        "samples": table.c.samples + excluded.samples,
+        "temperature_min": least(table.c.temperature_min, excluded.temperature_min),
+        "temperature_max": greatest(table.c.temperature_max, excluded.temperature_max),
+        "temperature_sum": table.c.temperature_sum + excluded.temperature_sum,
+        "humidity_sum": table.c.humidity_sum + excluded.humidity_sum,
+        "wind_speed_max": greatest(table.c.wind_speed_max, excluded.wind_speed_max),
+        "wind_speed_sum": table.c.wind_speed_sum + excluded.wind_speed_sum,
+    })
+
+
+async def save_alert_states(db: AsyncSession, states: Sequence[dict]) -> None:
+    """
+    Insert or replace a batch of alert states with one executemany.
+    """
+    if not states:
+        return
+    await db.execute(_upsert(db, models.AlertState.__table__, ["user_id", "location_id"]), states)
+    await db.commit()
+
+
+async def save_observations(db: AsyncSession, observations: Sequence[dict]) -> None:
+    """
+    Store a batch of weather observations with one executemany, skipping ones already stored.
+    """
+    if not observations:
+        return
+    await db.execute(_insert_ignoring_duplicates(db, models.WeatherObservation.__table__), observations)
+    await db.commit()
+
+
+async def downsample_observations(db: AsyncSession, raw_before: int, hourly_before: int) -> tuple[int, int]:
+    """
+    Roll raw observations older than raw_before into hourly buckets and hourly buckets older than
+    hourly_before into daily buckets, deleting the rows that were rolled up.
+
+    Both cutoffs should fall on bucket boundaries (whole hours and whole UTC days), so that every
+    bucket is normally rolled up in full by a single run. Rows that arrive for a bucket that was
+    already rolled up are merged into it. Returns the number of raw and hourly rows rolled up.
+    """
+    raw = models.WeatherObservation.__table__
+    hourly = models.HourlyObservation.__table__
+    daily = models.DailyObservation.__table__
+
+    # Bucket sizes are inlined so that PostgreSQL matches the grouped expression with the selected one
+    hour_seconds = literal_column("3600", BigInteger)
+    day_seconds = literal_column("86400", BigInteger)
+
+    hour = raw.c.observed_at // hour_seconds * hour_seconds
+    await db.execute(_insert_merging_rollups(db, hourly, select(
+        raw.c.cell,
+        hour,
+        func.count(),
+        func.min(raw.c.temperature),
+        func.max(raw.c.temperature),
+        func.sum(raw.c.temperature),
+        func.sum(raw.c.humidity),
+        func.max(raw.c.wind_speed),
+        func.sum(raw.c.wind_speed),
+    ).where(raw.c.observed_at < raw_before).group_by(raw.c.cell, hour)))
+    rolled_raw = (await db.execute(delete(raw).where(raw.c.observed_at < raw_before))).rowcount
+
+    day = hourly.c.bucket_start // day_seconds * day_seconds
+    await db.execute(_insert_merging_rollups(db, daily, select(
+        hourly.c.cell,
+        day,
+        func.sum(hourly.c.samples),
+        func.min(hourly.c.temperature_min),
+        func.max(hourly.c.temperature_max),
+        func.sum(hourly.c.temperature_sum),
+        func.sum(hourly.c.humidity_sum),
+        func.max(hourly.c.wind_speed_max),
+        func.sum(hourly.c.wind_speed_sum),
+    ).where(hourly.c.bucket_start < hourly_before).group_by(hourly.c.cell, day)))
+    rolled_hourly = (await db.execute(delete(hourly).where(hourly.c.bucket_start < hourly_before))).rowcount
+
+    await db.commit()
+    return rolled_raw, rolled_hourly
+
+
+async def stream_observations(db: AsyncSession, table: Table, cell: str, start: Optional[int] = None,
+                              end: Optional[int] = None, batch_size: int = 1000) -> AsyncIterator[Sequence[Row]]:
+    """
+    Stream the rows of an observation table (raw or a rollup) for one grid cell in time order,
+    optionally between the start and end Unix times.
+
+    Rows are read through a server-side cursor and yielded in batches of batch_size, so memory use
+    stays the same however many rows match.
+    """
+    time_column = table.c.observed_at if "observed_at" in table.c else table.c.bucket_start
+    query = select(table).where(table.c.cell == cell)
+    if start is not None:
+        query = query.where(time_column >= start)
+    if end is not None:
+        query = query.where(time_column < end)
+
+    result = await db.stream(query.order_by(time_column).execution_options(yield_per=batch_size))
+    async for rows in result.partitions():
+        yield rows
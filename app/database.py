@@ -1,25 +1,149 @@
-import sqlalchemy
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, Session
+import time
+import sqlalchemy.orm
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from app import metrics
 from app.config import settings
-from typing import Generator
+from typing import AsyncGenerator
 
-engine = create_engine(settings.DATABASE_URL)
+# Async drivers used by the application for each database backend
+ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+}
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+def async_database_url(url: str) -> str:
+    """
+    Convert a database URL to the equivalent URL for the backend's async driver.
+    """
+    parsed = make_url(url)
+    driver = ASYNC_DRIVERS.get(parsed.get_backend_name())
+    if driver is None:
+        return url
+    return parsed.set(drivername=driver).render_as_string(hide_password=False)
+
+
+def pool_options(url: str) -> dict:
+    """
+    Connection pool arguments from the settings. In-memory SQLite databases use a single
+    static connection and take none.
+    """
+    parsed = make_url(url)
+    if parsed.get_backend_name() == "sqlite" and parsed.database in (None, "", ":memory:"):
+        return {}
+    return {
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_timeout": settings.DB_POOL_TIMEOUT,
+        "pool_recycle": settings.DB_POOL_RECYCLE,
+        "pool_pre_ping": settings.DB_POOL_PRE_PING,
+    }
+
+
+pool_checkout_wait = metrics.histogram(
+    "db_pool_checkout_wait_seconds", "Time spent waiting for a connection from the database pool.",
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0))
+pool_timeouts = metrics.counter(
+    "db_pool_timeouts_total", "Connection checkouts that gave up after DB_POOL_TIMEOUT.")
+statement_latency = metrics.histogram(
+    "db_statement_duration_seconds", "Database statement execution time.")
+slow_statements = metrics.counter(
+    "db_slow_statements_total", "Statements slower than DB_SLOW_STATEMENT_SECONDS.")
+
+
+class InstrumentedAsyncQueuePool(AsyncAdaptedQueuePool):
+    """
+    Async queue pool that records how long each checkout waits for a connection.
+    """
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            pool_timeouts.inc()
+            raise
+        finally:
+            pool_checkout_wait.observe(time.perf_counter() - started)
+
+
+# Synchronous engine, used for schema management only
+engine = create_engine(settings.DATABASE_URL, **pool_options(settings.DATABASE_URL))
+
+# Async engine used by the routes, the alert sweep and the worker
+_async_url = settings.ASYNC_DATABASE_URL or async_database_url(settings.DATABASE_URL)
+_async_pool_options = pool_options(_async_url)
+if _async_pool_options:
+    _async_pool_options["poolclass"] = InstrumentedAsyncQueuePool
+async_engine = create_async_engine(_async_url, **_async_pool_options)
+
+
+def _enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+    """
+    SQLite ignores foreign keys unless enabled per connection, which ON DELETE CASCADE relies on.
+    """
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.close()
+
+
+for _engine in (engine, async_engine.sync_engine):
+    if _engine.dialect.name == "sqlite":
+        event.listen(_engine, "connect", _enable_sqlite_foreign_keys)
+
+
+@event.listens_for(async_engine.sync_engine, "before_cursor_execute")
+def _start_statement_timer(conn, cursor, statement, parameters, context, executemany):
+    # A connection runs one statement at a time, so a statement that fails is simply overwritten by the next
+    conn.info["statement_started"] = time.perf_counter()
+
+
+@event.listens_for(async_engine.sync_engine, "after_cursor_execute")
+def _record_statement_latency(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["statement_started"]
+    statement_latency.observe(elapsed)
+    if elapsed >= settings.DB_SLOW_STATEMENT_SECONDS:
+        slow_statements.inc()
+        print(f"Slow statement ({elapsed:.3f}s): {' '.join(statement.split())[:200]}")
+
+
+def _pool_checked_out() -> float:
+    pool = async_engine.sync_engine.pool
+    return pool.checkedout() if hasattr(pool, "checkedout") else 0
+
+
+def _pool_saturation() -> float:
+    """
+    Share of the pool's capacity (pool size plus overflow) currently checked out.
+    """
+    pool = async_engine.sync_engine.pool
+    if not hasattr(pool, "checkedout"):
+        return 0.0
+    overflow = pool._max_overflow if pool._max_overflow > 0 else 0
+    capacity = pool.size() + overflow
+    return pool.checkedout() / capacity if capacity else 0.0
+
+
+metrics.gauge("db_pool_checked_out", "Database connections currently checked out of the pool.",
+              callback=_pool_checked_out)
+metrics.gauge("db_pool_saturation", "Checked out connections as a fraction of pool size plus overflow.",
+              callback=_pool_saturation)
+
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
 
 Base = sqlalchemy.orm.declarative_base()
 
 
-def get_db() -> Generator[Session, None, None]:
+async def get_db() -> AsyncGenerator[AsyncSession, None]:
     """
     Get a database session to interact with the database.
 
-    This is a generator function that yields a new database session.
+    This is an async generator function that yields a new async database session.
     The session is properly closed after use to ensure that resources are released.
     """
-    db = SessionLocal()
-    try:
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
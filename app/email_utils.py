@@ -1,29 +1,49 @@
+import asyncio
+import hashlib
 import smtplib
+import time
+import zlib
+from collections import defaultdict
+from datetime import datetime, timezone
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
+from typing import List, Optional, Tuple
 
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from app import crud, utils
+from app import crud, mailer, metrics, models, schemas, utils
 from app.config import settings
 
+sweep_duration = metrics.histogram("sweep_duration_seconds", "Duration of one weather alert sweep of a shard.",
+                                   buckets=(0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0))
+sweep_locations_checked = metrics.counter("sweep_locations_checked_total",
+                                          "Grid cells checked by weather alert sweeps.")
+sweep_location_failures = metrics.counter("sweep_location_failures_total",
+                                          "Locations whose check failed or timed out during a sweep.")
+sweep_alerts_raised = metrics.counter("sweep_alerts_raised_total",
+                                      "Alert emails raised by sweeps, one per subscriber whose alerts started, "
+                                      "escalated, cleared or are due a reminder.")
+sweep_alerts_suppressed = metrics.counter("sweep_alerts_suppressed_total",
+                                          "Alert emails not sent because the subscriber was already told about "
+                                          "the same alerts.")
 
-def check_alerts(user_id: int, db: Session, subject: str, body: str) -> None:
+
+async def check_alerts(user_id: int, db: AsyncSession, subject: str, body: str) -> None:
     """
     Check user data and send weather alert email.
     """
-    user = crud.get_user(db, user_id)
+    user = await crud.get_user(db, user_id)
 
     if user is None:
         print(f"User with ID {user_id} not found.")
         return
 
-    send_email(subject, body, user.email)
+    await asyncio.to_thread(send_email, subject, body, user.email)
 
 
-def send_email(subject: str, body: str, to_email: str) -> None:
+def build_email(subject: str, body: str, to_email: str) -> MIMEMultipart:
     """
-    Send an email using the SMTP server.
+    Build a plain-text email message from the configured sender.
     """
     msg = MIMEMultipart()
     msg['From'] = settings.EMAIL_FROM
@@ -31,48 +51,229 @@ def send_email(subject: str, body: str, to_email: str) -> None:
     msg['Subject'] = subject
 
     msg.attach(MIMEText(body, 'plain'))
+    return msg
+
 
+def send_email(subject: str, body: str, to_email: str) -> None:
+    """
+    Send an email through the pooled SMTP connections.
+    """
     try:
-        with smtplib.SMTP(settings.SMTP_SERVER, settings.SMTP_PORT) as server:
-            server.starttls()
-            server.login(settings.SMTP_USER, settings.SMTP_PASSWORD)
-            server.sendmail(settings.EMAIL_FROM, to_email, msg.as_string())
+        mailer.get_pool().send(build_email(subject, body, to_email))
     except smtplib.SMTPAuthenticationError as e:
         print(f"SMTP Authentication Error: {e}")
     except Exception as e:
         print(f"Error: {e}")
 
 
-async def check_all_users_weather_alerts(db: Session) -> None:
+def location_shard(cell: str, shards: int) -> int:
+    """
+    Assign a grid cell to one of `shards` sweep shards by hashing it.
+    """
+    return zlib.crc32(cell.encode()) % shards
+
+
+def observation_row(cell: str, weather_data: schemas.WeatherData) -> dict:
+    """
+    Row of the weather_observations table for the current conditions of a grid cell.
+    """
+    return {
+        "cell": cell,
+        "observed_at": weather_data.observed_at or int(time.time()),
+        "latitude": weather_data.latitude,
+        "longitude": weather_data.longitude,
+        "temperature": weather_data.temperature,
+        "humidity": weather_data.humidity,
+        "wind_speed": weather_data.wind_speed,
+        "condition": weather_data.condition,
+        "description": weather_data.weather_description,
+    }
+
+
+def alert_fingerprint(alerts: List[str]) -> str:
+    """
+    Fingerprint of a set of active alerts, or an empty string when there are none.
+    """
+    if not alerts:
+        return ""
+    return hashlib.sha256("\n".join(sorted(set(alerts))).encode()).hexdigest()
+
+
+def alert_transition(state: Optional[models.AlertState], alerts: List[str], now: datetime) -> Optional[str]:
+    """
+    Decide whether a subscriber should be emailed about the alerts now active at a location.
+
+    Returns "new" when alerts start, "escalated" when alerts the subscriber was not told about
+    are added, "cleared" when every alert has ended, "reminder" when the same alerts are still
+    active ALERT_RENOTIFY_INTERVAL_SECONDS after the last email, and None otherwise.
+    """
+    previous = set(state.alerts.splitlines()) if state is not None else set()
+    current = set(alerts)
+    if not previous:
+        return "new" if current else None
+    if not current:
+        return "cleared"
+    if not current <= previous:
+        return "escalated"
+    interval = settings.ALERT_RENOTIFY_INTERVAL_SECONDS
+    if interval > 0 and current == previous:
+        notified_at = state.notified_at
+        # SQLite hands back naive datetimes, which were stored in UTC
+        if notified_at.tzinfo is None:
+            notified_at = notified_at.replace(tzinfo=timezone.utc)
+        if (now - notified_at).total_seconds() >= interval:
+            return "reminder"
+    return None
+
+
+def alert_email(transition: str, user: models.Users, location: models.FavoriteLocation,
+                alerts: List[str]) -> MIMEMultipart:
+    """
+    Build the alert email telling a subscriber about a change in the alerts for a location.
+    """
+    if transition == "cleared":
+        subject = f"Weather Alert Cleared for {location.name}"
+        details = "The severe weather conditions you were alerted about have ended."
+    else:
+        subject = {
+            "new": f"Severe Weather Alert for {location.name}!",
+            "escalated": f"Updated Severe Weather Alert for {location.name}!",
+            "reminder": f"Reminder: Severe Weather Continues in {location.name}",
+        }[transition]
+        alert_message = "\n".join(alerts)
+        details = (f"Severe weather conditions are expected in {location.name}.\n"
+                   f"Details:\n{alert_message}\n\n"
+                   "Please stay safe and take precautions.")
+    body = (
+        f"Dear {user.username},\n\n"
+        f"{details}\n\n"
+        "Best regards,\nThe Weather App Team"
+    )
+    return build_email(subject, body, user.email)
+
+
+async def check_all_users_weather_alerts(db: AsyncSession, shard: int = 0, shards: int = 1) -> None:
     """
     Check all favorite cities for every user in the database and send weather alerts if any.
+
+    With `shards` > 1 only the grid cells that hash to `shard` are checked, so that several
+    workers can split one sweep between them.
+
+    All alert subscriptions are loaded with one query. Locations are grouped into geohash cells
+    of WEATHER_CELL_PRECISION characters, and each cell is checked only once per run, however many
+    users watch places in it. Cells are checked concurrently, at most SWEEP_CONCURRENCY at a time,
+    and a cell that does not answer within SWEEP_LOCATION_TIMEOUT seconds is skipped for this run.
+
+    The alerts each subscriber was last told about are loaded with the subscriptions, and emails
+    only go out when they change (see alert_transition). Cells whose check failed keep their
+    previous alert state.
     """
-    # Get all users from the database
-    users = crud.get_users_with_auto_check_enabled(db)
+    started = time.perf_counter()
+
+    # Load every (user, location) pair that should be checked and group them by grid cell
+    subscribers = defaultdict(list)
+    for user, location, state in await crud.get_alert_subscriptions(db):
+        cell = utils.location_cell(location)
+        if shards > 1 and location_shard(cell, shards) != shard:
+            continue
+        subscribers[cell].append((user, location, state))
+
+    # Check for extreme weather conditions once per cell, concurrently
+    semaphore = asyncio.Semaphore(settings.SWEEP_CONCURRENCY)
+    cells = list(subscribers)
+    results = await asyncio.gather(*(
+        _check_location(semaphore, location.name, location.latitude, location.longitude)
+        for location in (subscribers[cell][0][1] for cell in cells)
+    ))
 
-    # Iterate over each user
-    for user in users:
-        favorite_locations = crud.get_favorite_locations(db, user_id=user.id, send_alert=True)
+    # Keep what was observed in every cell, whether or not it raised alerts
+    observations = [
+        observation_row(cell, result["weather_data"])
+        for cell, result in zip(cells, results)
+        if result is not None and result.get("weather_data") is not None
+    ]
+    try:
+        await crud.save_observations(db, observations)
+    except Exception as e:
+        await db.rollback()
+        print(f"Error storing weather observations: {e}")
 
-        # Iterate over each favorite location for the user
-        for location in favorite_locations:
-            lat, lon = location.latitude, location.longitude
+    now = datetime.now(timezone.utc)
+    messages, notified_states, states = [], [], []
+    suppressed = 0
+    for key, severe_weather in zip(cells, results):
+        if severe_weather is None:
+            continue
 
-            # Check for extreme weather conditions
-            severe_weather = await utils.check_extreme_weather(lat, lon)
+        alerts = sorted(set(severe_weather.get("alerts") or [])) if severe_weather.get("severe_weather") else []
+        fingerprint = alert_fingerprint(alerts)
 
-            if severe_weather.get("severe_weather"):
-                alerts = severe_weather.get("alerts")
-                alert_message = "\n".join(alerts)
+        # Fan the result out to everyone watching this location
+        for user, location, state in subscribers[key]:
+            transition = alert_transition(state, alerts, now)
+            row = {"user_id": user.id, "location_id": location.id, "fingerprint": fingerprint,
+                   "alerts": "\n".join(alerts), "updated_at": now, "notified_at": now}
+            if transition is not None:
+                messages.append(alert_email(transition, user, location, alerts))
+                notified_states.append(row)
+            elif state is not None and state.fingerprint != fingerprint:
+                # Some alerts ended but others remain: record it without an email
+                states.append({**row, "notified_at": state.notified_at})
+            elif alerts:
+                suppressed += 1
 
-                subject = f"Severe Weather Alert for {location.name}!"
-                body = (
-                    f"Dear {user.username},\n\n"
-                    f"Severe weather conditions are expected in {location.name}.\n"
-                    f"Details:\n{alert_message}\n\n"
-                    f"Please stay safe and take precautions.\n\n"
-                    f"Best regards,\nThe Weather App Team"
-                )
+    # Emails handed to the SMTP pool go out even if the sweep is cancelled, so finish recording
+    # them before giving up; otherwise the next sweep of this shard would send them again
+    delivery = asyncio.ensure_future(_deliver_alerts(db, messages, notified_states, states))
+    try:
+        alerts_sent, alerts_failed = await asyncio.shield(delivery)
+    except asyncio.CancelledError:
+        await delivery
+        raise
 
-                # Send the email alert
-                send_email(subject, body, user.email)
+    duration = time.perf_counter() - started
+    failed = sum(result is None for result in results)
+    sweep_duration.observe(duration)
+    sweep_locations_checked.inc(len(cells))
+    sweep_location_failures.inc(failed)
+    sweep_alerts_raised.inc(len(messages))
+    sweep_alerts_suppressed.inc(suppressed)
+    subscriptions = sum(len(pairs) for pairs in subscribers.values())
+    throughput = len(cells) / duration if duration > 0 else 0.0
+    print(f"Weather alert sweep of shard {shard}/{shards} checked {len(cells)} cells for {subscriptions} subscriptions "
+          f"in {duration:.2f}s ({throughput:.1f} cells/s), {failed} failed, "
+          f"{alerts_sent} alerts sent, {alerts_failed} alerts failed, {suppressed} suppressed.")
+
+
+async def _deliver_alerts(db: AsyncSession, messages: List[MIMEMultipart], notified_states: List[dict],
+                          states: List[dict]) -> Tuple[int, int]:
+    """
+    Send alert emails as one batch over the pooled SMTP connections, then store the alert states
+    of the emails that were sent along with `states`. Returns the number of emails sent and failed.
+    """
+    outcomes = await asyncio.to_thread(mailer.get_pool().send_each, messages)
+    alerts_sent = sum(outcomes)
+
+    # Only remember alerts that reached the subscriber, so failed emails are retried next sweep
+    states = states + [row for row, sent in zip(notified_states, outcomes) if sent]
+    try:
+        await crud.save_alert_states(db, states)
+    except Exception as e:
+        await db.rollback()
+        print(f"Error storing alert states: {e}")
+    return alerts_sent, len(outcomes) - alerts_sent
+
+
+async def _check_location(semaphore: asyncio.Semaphore, name: str, lat: float, lon: float) -> Optional[dict]:
+    """
+    Check one location for extreme weather, returning None if the check failed or timed out.
+    """
+    async with semaphore:
+        try:
+            return await asyncio.wait_for(utils.check_extreme_weather(lat, lon),
+                                          timeout=settings.SWEEP_LOCATION_TIMEOUT)
+        except asyncio.TimeoutError:
+            print(f"Timed out checking weather for {name}.")
+        except Exception as e:
+            print(f"Error checking weather for {name}: {e}")
+    return None
@@ -0,0 +1,143 @@
+import time
+from datetime import date
+from typing import Dict, List, Tuple, Union
+
+import numpy as np
+
+from app.upstream import Forecast
+
+# Each forecast entry covers the three hours starting at its timestamp
+ENTRY_SECONDS = 3 * 3600
+DAY_SECONDS = 24 * 3600
+
+
+def merge_windows(starts: np.ndarray, length: int = ENTRY_SECONDS) -> List[Tuple[int, int]]:
+    """
+    Merge sorted window start times of a fixed length into (start, end) pairs of overlapping or touching windows.
+    """
+    if starts.size == 0:
+        return []
+    # A window opens a new period when it starts after every earlier window has ended
+    running_end = np.maximum.accumulate(starts + length)
+    breaks = np.flatnonzero(starts[1:] > running_end[:-1]) + 1
+    period_starts = starts[np.concatenate(([0], breaks))]
+    period_ends = running_end[np.concatenate((breaks - 1, [starts.size - 1]))]
+    return list(zip(period_starts.tolist(), period_ends.tolist()))
+
+
+def _utc_offsets(timestamps: np.ndarray) -> Union[int, np.ndarray]:
+    """
+    Local UTC offsets in seconds for Unix timestamps. A forecast spans five days, so unless a
+    daylight saving change falls within it, one offset covers every entry.
+    """
+    if timestamps.size == 0:
+        return 0
+    first = time.localtime(int(timestamps.min())).tm_gmtoff
+    if time.localtime(int(timestamps.max())).tm_gmtoff == first:
+        return first
+    return np.fromiter((time.localtime(timestamp).tm_gmtoff for timestamp in timestamps.tolist()),
+                       dtype=np.int64, count=timestamps.size)
+
+
+class ForecastFrame:
+    """
+    Columnar view of a 5-day forecast, built once per upstream response.
+
+    Every attribute is a NumPy array with one element per 3-hour forecast entry, sorted by time.
+    """
+
+    __slots__ = ("timestamps", "local_days", "temperature", "wind_speed", "rain_volume",
+                 "condition_codes", "is_rain", "condition_names")
+
+    def __init__(self, timestamps: np.ndarray, local_days: np.ndarray, temperature: np.ndarray,
+                 wind_speed: np.ndarray, rain_volume: np.ndarray, condition_codes: np.ndarray,
+                 is_rain: np.ndarray, condition_names: Dict[int, str]):
+        self.timestamps = timestamps
+        self.local_days = local_days
+        self.temperature = temperature
+        self.wind_speed = wind_speed
+        self.rain_volume = rain_volume
+        self.condition_codes = condition_codes
+        self.is_rain = is_rain
+        self.condition_names = condition_names
+
+    @classmethod
+    def from_forecast(cls, forecast: Forecast) -> "ForecastFrame":
+        """
+        Build a frame from a decoded 5-day forecast, in one pass over its entries.
+        """
+        timestamps, temps, wind_speeds, rain_volumes = [], [], [], []
+        codes, rain_flags, condition_names = [], [], {}
+        for entry in forecast.list:
+            timestamps.append(entry.dt)
+            temps.append(entry.main.temp)
+            wind_speeds.append(entry.wind.speed if entry.wind else 0.0)
+            rain_volumes.append(entry.rain.three_hours if entry.rain else 0.0)
+            conditions = entry.weather
+            if not conditions:
+                codes.append(0)
+                rain_flags.append(False)
+                continue
+            codes.append(conditions[0].id)
+            rain_flags.append("rain" in "\n".join([condition.description for condition in conditions]).lower())
+            for condition in conditions:
+                if condition.id not in condition_names:
+                    condition_names[condition.id] = condition.main
+
+        columns = [np.array(timestamps, dtype=np.int64), np.array(temps, dtype=np.float64),
+                   np.array(wind_speeds, dtype=np.float64), np.array(rain_volumes, dtype=np.float64),
+                   np.array(codes, dtype=np.int32), np.array(rain_flags, dtype=np.bool_)]
+        # Upstream lists entries in time order; only reorder when it does not
+        if not np.all(columns[0][1:] >= columns[0][:-1]):
+            order = np.argsort(columns[0], kind="stable")
+            columns = [column[order] for column in columns]
+        timestamps, temps, wind_speeds, rain_volumes, codes, rain_flags = columns
+
+        # Day number in the server's local time, matching datetime.fromtimestamp
+        local_days = (timestamps + _utc_offsets(timestamps)) // DAY_SECONDS
+        return cls(timestamps, local_days, temps, wind_speeds, rain_volumes, codes, rain_flags, condition_names)
+
+    def __len__(self) -> int:
+        return self.timestamps.size
+
+    @staticmethod
+    def day_number(day: date) -> int:
+        """
+        Convert a calendar date to the day numbering used by local_days.
+        """
+        return (day - date(1970, 1, 1)).days
+
+    def rain_on(self, day: date) -> Tuple[bool, float, List[Tuple[int, int]]]:
+        """
+        Whether rain is forecast on a local calendar day, its total volume in mm
+        and the merged rain periods as (start, end) Unix timestamps.
+        """
+        mask = (self.local_days == self.day_number(day)) & self.is_rain
+        periods = merge_windows(self.timestamps[mask])
+        total_rain_volume = round(float(self.rain_volume[mask].sum()), 1)
+        return bool(periods), total_rain_volume, periods
+
+    def daily(self) -> Dict[str, np.ndarray]:
+        """
+        Aggregate the forecast per local calendar day.
+
+        Returns arrays of the day numbers and, for each day, the min/max temperature,
+        total rain volume, peak wind speed and most frequent condition code.
+        """
+        if not len(self):
+            empty = np.array([])
+            return {"days": empty.astype(np.int64), "temp_min": empty, "temp_max": empty,
+                    "rain_volume": empty, "wind_max": empty, "condition_code": empty.astype(np.int32)}
+
+        days, starts = np.unique(self.local_days, return_index=True)
+        bounds = np.append(starts, len(self))
+        dominant = np.array([np.bincount(self.condition_codes[start:end]).argmax()
+                             for start, end in zip(bounds[:-1], bounds[1:])], dtype=np.int32)
+        return {
+            "days": days,
+            "temp_min": np.minimum.reduceat(self.temperature, starts),
+            "temp_max": np.maximum.reduceat(self.temperature, starts),
+            "rain_volume": np.add.reduceat(self.rain_volume, starts),
+            "wind_max": np.maximum.reduceat(self.wind_speed, starts),
+            "condition_code": dominant,
+        }
@@ -0,0 +1,48 @@
+"""
+Geohash encoding, used to bucket nearby coordinates into grid cells.
+
+A geohash prefix is the cell containing every longer hash that starts with it, so locations
+stored at STORED_PRECISION can be grouped into coarser cells by truncating their hash.
+"""
+
+BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+# Length of the geohash stored with each favorite location (cells of about 5 m x 5 m)
+STORED_PRECISION = 9
+
+
+def encode(latitude: float, longitude: float, precision: int = STORED_PRECISION) -> str:
+    """
+    Encode coordinates as a geohash of the given length.
+    """
+    lat_low, lat_high = -90.0, 90.0
+    lon_low, lon_high = -180.0, 180.0
+    chars = []
+    value = 0
+    bits = 0
+    # Bits alternate between longitude and latitude, starting with longitude
+    even = True
+    while len(chars) < precision:
+        if even:
+            mid = (lon_low + lon_high) / 2
+            if longitude >= mid:
+                value = value * 2 + 1
+                lon_low = mid
+            else:
+                value *= 2
+                lon_high = mid
+        else:
+            mid = (lat_low + lat_high) / 2
+            if latitude >= mid:
+                value = value * 2 + 1
+                lat_low = mid
+            else:
+                value *= 2
+                lat_high = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(BASE32[value])
+            value = 0
+            bits = 0
+    return "".join(chars)
@@ -0,0 +1,72 @@
+import time
+from typing import Any, Optional
+
+import httpx
+
+from app import metrics
+from app.config import settings
+
+# Client owned by the FastAPI lifespan and shared by every upstream call
+_client: Optional[httpx.AsyncClient] = None
+
+upstream_latency = metrics.histogram("owm_request_duration_seconds",
+                                     "Latency of OpenWeatherMap API calls, by endpoint.", ("endpoint",))
+upstream_responses = metrics.counter("owm_responses_total",
+                                     "OpenWeatherMap API calls by endpoint and HTTP status; "
+                                     "status is \"error\" when no response was received.", ("endpoint", "status"))
+
+
+def create_client() -> httpx.AsyncClient:
+    """
+    Build a keep-alive HTTP client for the OpenWeatherMap API using the configured pool limits and timeouts.
+    """
+    limits = httpx.Limits(
+        max_connections=settings.OWM_HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=settings.OWM_HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=settings.OWM_HTTP_KEEPALIVE_EXPIRY,
+    )
+    timeout = httpx.Timeout(settings.OWM_HTTP_TIMEOUT, connect=settings.OWM_HTTP_CONNECT_TIMEOUT)
+    return httpx.AsyncClient(base_url=settings.OWM_BASE_URL, limits=limits, timeout=timeout)
+
+
+async def open_client() -> None:
+    """
+    Create the shared client. Called once on application startup.
+    """
+    global _client
+    if _client is None:
+        _client = create_client()
+
+
+async def close_client() -> None:
+    """
+    Close the shared client and release its pooled connections. Called on application shutdown.
+    """
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def get_client() -> httpx.AsyncClient:
+    """
+    Return the client that upstream calls should use.
+    """
+    if _client is None:
+        raise RuntimeError("HTTP client is not initialized; call open_client() on startup.")
+    return _client
+
+
+async def fetch(path: str, params: Optional[dict[str, Any]] = None) -> httpx.Response:
+    """
+    GET an upstream endpoint with the shared client, recording its latency and status.
+    """
+    started = time.perf_counter()
+    status = "error"
+    try:
+        response = await get_client().get(path, params=params)
+        status = str(response.status_code)
+        return response
+    finally:
+        upstream_latency.observe(time.perf_counter() - started, endpoint=path)
+        upstream_responses.inc(endpoint=path, status=status)
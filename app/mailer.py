@@ -0,0 +1,194 @@
+import queue
+import smtplib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.message import Message
+from typing import Iterable, List, Optional
+
+from app import metrics
+from app.config import settings
+
+emails_sent = metrics.counter("emails_sent_total", "Emails accepted by the SMTP server.")
+emails_failed = metrics.counter("emails_failed_total", "Emails given up on after their retries.")
+smtp_retries = metrics.counter("smtp_retries_total", "SMTP send attempts retried after a temporary failure.")
+smtp_latency = metrics.histogram("smtp_send_duration_seconds",
+                                 "Time to send one email, including connecting and retries.")
+
+
+def _is_retryable(error: Exception) -> bool:
+    """
+    Decide whether a failed send is worth retrying on a fresh connection.
+    """
+    if isinstance(error, (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError)):
+        return True
+    if isinstance(error, smtplib.SMTPResponseException):
+        # 4xx replies are temporary failures, 5xx replies (bad credentials, rejected mail) are permanent
+        return 400 <= error.smtp_code < 500
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return False
+    return isinstance(error, OSError)
+
+
+class SMTPPool:
+    """
+    Pool of authenticated SMTP connections that are kept open and reused across messages.
+    """
+
+    def __init__(self, host: str, port: int, username: str, password: str, size: int = 2,
+                 starttls: bool = True, timeout: float = 30.0, max_retries: int = 3, backoff: float = 0.5):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.size = size
+        self.starttls = starttls
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self._idle: "queue.LifoQueue[smtplib.SMTP]" = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def _connect(self) -> smtplib.SMTP:
+        """
+        Open a new connection, upgrade it to TLS and log in.
+        """
+        connection = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            if self.starttls:
+                connection.starttls()
+            if self.username:
+                connection.login(self.username, self.password)
+        except Exception:
+            connection.close()
+            raise
+        return connection
+
+    def _acquire(self) -> smtplib.SMTP:
+        """
+        Take an idle connection from the pool, opening a new one if none is available.
+        """
+        self._slots.acquire()
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            try:
+                return self._connect()
+            except Exception:
+                self._slots.release()
+                raise
+
+    def _release(self, connection: smtplib.SMTP, broken: bool = False) -> None:
+        """
+        Return a connection to the pool, or discard it if it failed.
+        """
+        if broken:
+            try:
+                connection.close()
+            except Exception:
+                pass
+        else:
+            self._idle.put(connection)
+        self._slots.release()
+
+    def send(self, message: Message) -> None:
+        """
+        Send one message, reconnecting and retrying with exponential backoff on temporary failures.
+        """
+        started = time.perf_counter()
+        attempt = 0
+        while True:
+            connection = None
+            try:
+                connection = self._acquire()
+                connection.send_message(message)
+            except Exception as e:
+                if connection is not None:
+                    self._release(connection, broken=True)
+                if attempt >= self.max_retries or not _is_retryable(e):
+                    emails_failed.inc()
+                    smtp_latency.observe(time.perf_counter() - started)
+                    raise
+                smtp_retries.inc()
+                time.sleep(self.backoff * 2 ** attempt)
+                attempt += 1
+            else:
+                self._release(connection)
+                emails_sent.inc()
+                smtp_latency.observe(time.perf_counter() - started)
+                return
+
+    def send_each(self, messages: Iterable[Message]) -> List[bool]:
+        """
+        Send many messages over the pooled connections in parallel.
+
+        Returns whether each message was sent, in order.
+        """
+        messages = list(messages)
+        if not messages:
+            return []
+
+        workers = min(self.size, len(messages))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(self._send_quietly, messages))
+
+    def _send_quietly(self, message: Message) -> bool:
+        """
+        Send a message, reporting failure instead of raising.
+        """
+        try:
+            self.send(message)
+            return True
+        except Exception as e:
+            print(f"Error sending email to {message['To']}: {e}")
+            return False
+
+    def close(self) -> None:
+        """
+        Close every idle connection.
+        """
+        while True:
+            try:
+                connection = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                connection.quit()
+            except Exception:
+                connection.close()
+
+
+_pool: Optional[SMTPPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> SMTPPool:
+    """
+    Return the process-wide SMTP pool, creating it on first use.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = SMTPPool(
+                host=settings.SMTP_SERVER,
+                port=settings.SMTP_PORT,
+                username=settings.SMTP_USER,
+                password=settings.SMTP_PASSWORD,
+                size=settings.SMTP_POOL_SIZE,
+                starttls=settings.SMTP_STARTTLS,
+                timeout=settings.SMTP_TIMEOUT,
+                max_retries=settings.SMTP_MAX_RETRIES,
+                backoff=settings.SMTP_RETRY_BACKOFF,
+            )
+        return _pool
+
+
+def close_pool() -> None:
+    """
+    Close the process-wide SMTP pool. Called on application shutdown.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
@@ -1,42 +1,37 @@
 from fastapi import FastAPI
-from app import database, models, email_utils
+from fastapi.middleware.gzip import GZipMiddleware
+from app import database, models, http_client, mailer, metrics
+from app.config import settings
 from app.routers import users, weather, auth
 from starlette.staticfiles import StaticFiles
-from starlette.responses import RedirectResponse
+from starlette.responses import PlainTextResponse, RedirectResponse
 from starlette import status
-from apscheduler.schedulers.background import BackgroundScheduler
-import asyncio
 from contextlib import asynccontextmanager
 
 # Create the database tables
 models.Base.metadata.create_all(bind=database.engine)
 
-scheduler = BackgroundScheduler()
-
-
-# Schedule the job to check weather alerts every 3 minutes
-@scheduler.scheduled_job('interval', minutes=5)
-def scheduled_check_all_users_weather_alerts():
-    loop = asyncio.new_event_loop()  # Create a new event loop
-    asyncio.set_event_loop(loop)  # Set the new event loop as the current one
-    with database.SessionLocal() as db:  # Create a new database session
-        loop.run_until_complete(email_utils.check_all_users_weather_alerts(db))  # Run the async function
-    loop.close()  # Close the loop after execution
-
-
-scheduler.start()
-
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup tasks
+    # The weather alert sweep runs in a separate worker process (python -m app.worker)
+    await http_client.open_client()
     yield
     # Shutdown tasks
-    scheduler.shutdown()
+    await http_client.close_client()
+    mailer.close_pool()
+    await database.async_engine.dispose()
 
 
 app = FastAPI(lifespan=lifespan)
 
+# Compress responses for clients that send Accept-Encoding: gzip
+app.add_middleware(GZipMiddleware, minimum_size=settings.GZIP_MINIMUM_SIZE)
+
+# Record per-route request latency, including compression time
+app.add_middleware(metrics.RequestMetricsMiddleware)
+
 # Include routers for users, weather, and authentication
 app.include_router(users.router)
 app.include_router(weather.router)
@@ -50,3 +45,9 @@ app.mount("/static", StaticFiles(directory="static"), name="static")
 async def root() -> RedirectResponse:
     """Redirect to the weather page."""
     return RedirectResponse(url="/weather", status_code=status.HTTP_302_FOUND)
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics_endpoint() -> PlainTextResponse:
+    """Expose in-process metrics in the Prometheus text format."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, Boolean
+from sqlalchemy import BigInteger, Column, Integer, String, Text, ForeignKey, Boolean, Float, DateTime
 from sqlalchemy.orm import relationship
 from app.database import Base
 
@@ -31,9 +31,109 @@ class FavoriteLocation(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, index=True)
-    latitude = Column(String)
-    longitude = Column(String)
+    latitude = Column(Float)
+    longitude = Column(Float)
+    geohash = Column(String(12), index=True)  # Geohash of the coordinates at geo.STORED_PRECISION, set on insert
     send_alert = Column(Boolean, default=False, nullable=False)
+    owm_city_id = Column(Integer, nullable=True)  # OpenWeatherMap city ID, used for grouped weather lookups
 
     owner_id = Column(Integer, ForeignKey('users.id'))
     owner = relationship("Users", back_populates="favorite_locations")
+
+
+class GeocodeCache(Base):
+    """
+    Model representing a cached geocoding result for a normalized city query.
+    A row without coordinates records that the city was not found.
+    """
+
+    __tablename__ = "geocode_cache"
+
+    query = Column(String, primary_key=True)
+    latitude = Column(Float, nullable=True)
+    longitude = Column(Float, nullable=True)
+    expires_at = Column(DateTime(timezone=True), nullable=False)
+
+
+class WorkerLease(Base):
+    """
+    Model representing a time-limited lease that lets a single worker own a background job,
+    such as one shard of the weather alert sweep.
+    """
+
+    __tablename__ = "worker_leases"
+
+    name = Column(String, primary_key=True)
+    holder = Column(String, nullable=False)
+    expires_at = Column(DateTime(timezone=True), nullable=False)
+    completed_at = Column(DateTime(timezone=True), nullable=True)
+
+
+class AlertState(Base):
+    """
+    Model representing the weather alerts a user was last told about for one favorite location,
+    so that the sweep only emails them when the alerts change.
+    """
+
+    __tablename__ = "alert_states"
+
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    location_id = Column(Integer, ForeignKey("favorite_locations.id", ondelete="CASCADE"), primary_key=True)
+    fingerprint = Column(String(64), nullable=False)  # SHA-256 of the sorted active alerts; empty when clear
+    alerts = Column(Text, nullable=False)  # Active alert messages, one per line
+    updated_at = Column(DateTime(timezone=True), nullable=False)
+    notified_at = Column(DateTime(timezone=True), nullable=False)
+
+
+class WeatherObservation(Base):
+    """
+    Model representing the current conditions observed for a grid cell by the weather alert sweep.
+
+    Rows are keyed by cell and the upstream observation time, so re-reading a cached
+    observation does not store it twice.
+    """
+
+    __tablename__ = "weather_observations"
+
+    cell = Column(String(12), primary_key=True)
+    observed_at = Column(BigInteger, primary_key=True, index=True)  # Unix time of the observation
+    latitude = Column(Float, nullable=False)
+    longitude = Column(Float, nullable=False)
+    temperature = Column(Float, nullable=False)
+    humidity = Column(Integer, nullable=False)
+    wind_speed = Column(Float, nullable=False)
+    condition = Column(String, nullable=False)
+    description = Column(String, nullable=False)
+
+
+class ObservationRollup:
+    """
+    Columns shared by the downsampled observation tables. Sums are stored instead of averages
+    so that buckets can be rolled up again; the average is the sum divided by samples.
+    """
+
+    cell = Column(String(12), primary_key=True)
+    bucket_start = Column(BigInteger, primary_key=True, index=True)  # Unix time the bucket starts at
+    samples = Column(Integer, nullable=False)
+    temperature_min = Column(Float, nullable=False)
+    temperature_max = Column(Float, nullable=False)
+    temperature_sum = Column(Float, nullable=False)
+    humidity_sum = Column(Float, nullable=False)
+    wind_speed_max = Column(Float, nullable=False)
+    wind_speed_sum = Column(Float, nullable=False)
+
+
+class HourlyObservation(ObservationRollup, Base):
+    """
+    Model representing observations of a grid cell downsampled to one row per hour.
+    """
+
+    __tablename__ = "weather_observations_hourly"
+
+
+class DailyObservation(ObservationRollup, Base):
+    """
+    Model representing observations of a grid cell downsampled to one row per UTC day.
+    """
+
+    __tablename__ = "weather_observations_daily"
@@ -1,24 +1,41 @@
+import asyncio
+import hashlib
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Optional, Tuple
 
 import jwt as jwt
 from jose import jwt, JWTError
 from passlib.context import CryptContext
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from starlette.responses import RedirectResponse
 from fastapi import Depends, HTTPException, status, APIRouter, Request, Response, Form
 from fastapi.security import OAuth2PasswordRequestForm, OAuth2PasswordBearer
 from fastapi.responses import HTMLResponse
 from fastapi.templating import Jinja2Templates
 
-from app import models
+from app import crud, models, schemas, utils
+from app.cache import MISSING, TTLCache
 from app.config import settings
-from app.database import (engine, get_db)
+from app.database import (AsyncSessionLocal, engine, get_db)
 
 
 templates = Jinja2Templates(directory="templates")
 
-bcrypt_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Hashes with any other cost factor are reported by needs_update and upgraded on login
+bcrypt_context = CryptContext(schemes=["bcrypt"], deprecated="auto",
+                              bcrypt__default_rounds=settings.BCRYPT_ROUNDS,
+                              bcrypt__min_rounds=settings.BCRYPT_ROUNDS,
+                              bcrypt__max_rounds=settings.BCRYPT_ROUNDS)
+
+# bcrypt is deliberately slow, so it runs on a few dedicated threads instead of the event loop
+password_executor = ThreadPoolExecutor(max_workers=settings.BCRYPT_WORKERS, thread_name_prefix="bcrypt")
+
+# Verified token claims keyed by the token's SHA-256 digest, and signed-in users keyed by ID
+token_cache = TTLCache(maxsize=settings.TOKEN_CACHE_SIZE, ttl=settings.TOKEN_CACHE_TTL)
+principal_cache = TTLCache(maxsize=settings.TOKEN_CACHE_SIZE, ttl=settings.PRINCIPAL_CACHE_TTL)
+utils.caches.update(token=token_cache, principal=principal_cache)
 
 models.Base.metadata.create_all(bind=engine)
 
@@ -43,35 +60,72 @@ class LoginForm:
         self.password = form.get("password")
 
 
-def get_password_hash(password):
+async def get_password_hash(password: str) -> str:
     """
-    Hash a password using bcrypt.
+    Hash a password using bcrypt on the password threads.
     """
-    return bcrypt_context.hash(password)
+    return await asyncio.get_running_loop().run_in_executor(password_executor, bcrypt_context.hash, password)
 
 
-def verify_password(plain_password, hashed_password):
+async def verify_password(plain_password: str, hashed_password: str) -> bool:
     """
-    Verify a plain password against a hashed password.
+    Verify a plain password against a hashed password on the password threads.
     """
-    return bcrypt_context.verify(plain_password, hashed_password)
+    return await asyncio.get_running_loop().run_in_executor(
+        password_executor, bcrypt_context.verify, plain_password, hashed_password)
 
 
-def authenticate_user(username: str, password: str, db):
+async def verify_and_update_password(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
     """
-    Authenticate a user by checking their credentials.
+    Verify a password and, if its hash uses an outdated cost factor, rehash it.
+
+    Returns whether the password matched and the replacement hash, or None if the hash is current.
     """
-    user = db.query(models.Users) \
-        .filter(models.Users.username == username) \
-        .first()
+    return await asyncio.get_running_loop().run_in_executor(
+        password_executor, bcrypt_context.verify_and_update, plain_password, hashed_password)
+
+
+async def authenticate_user(username: str, password: str, db: AsyncSession):
+    """
+    Authenticate a user by checking their credentials, upgrading their password hash if needed.
+    """
+    user = await crud.get_user_by_username(db, username)
 
     if not user:
         return False
-    if not verify_password(password, user.hashed_password):
+    verified, new_hash = await verify_and_update_password(password, user.hashed_password)
+    if not verified:
         return False
+    if new_hash is not None:
+        user.hashed_password = new_hash
+        await db.commit()
+    remember_principal(user)
     return user
 
 
+def remember_principal(user: models.Users) -> schemas.Principal:
+    """
+    Cache the page-facing fields of a user. Call it whenever those fields change.
+    """
+    principal = schemas.Principal.model_validate(user)
+    principal_cache.set(user.id, principal)
+    return principal
+
+
+async def get_principal(user_id: int) -> Optional[schemas.Principal]:
+    """
+    Return a signed-in user's cached profile, loading it from the database on a miss.
+    """
+    principal = principal_cache.get(user_id)
+    if principal is not MISSING:
+        return principal
+    async with AsyncSessionLocal() as db:
+        user = await crud.get_user(db, user_id)
+    if user is None:
+        return None
+    return remember_principal(user)
+
+
 def create_access_token(username: str, user_id: int,
                         expires_delta: Optional[timedelta] = None):
     """
@@ -86,7 +140,27 @@ def create_access_token(username: str, user_id: int,
     return jwt.encode(encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
 
 
-async def get_current_user(request: Request):
+def verify_token(token: str) -> Optional[int]:
+    """
+    Decode an access token and return its user ID, reusing the result for tokens seen recently.
+    """
+    digest = hashlib.sha256(token.encode()).digest()
+    user_id = token_cache.get(digest)
+    if user_id is not MISSING:
+        return user_id
+
+    payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+    user_id = payload.get("id") if payload.get("sub") is not None else None
+    # Never keep a token past its own expiry
+    ttl = settings.TOKEN_CACHE_TTL
+    if payload.get("exp") is not None:
+        ttl = min(ttl, payload["exp"] - time.time())
+    if ttl > 0:
+        token_cache.set(digest, user_id, ttl=ttl)
+    return user_id
+
+
+async def get_current_user(request: Request) -> Optional[schemas.Principal]:
     """
     Retrieve the current user from the request's cookies.
     """
@@ -94,23 +168,22 @@ async def get_current_user(request: Request):
         token = request.cookies.get("access_token")
         if token is None:
             return None
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
-        username: str = payload.get("sub")
-        user_id: int = payload.get("id")
-        if username is None or user_id is None:
+        user_id = verify_token(token)
+        if user_id is None:
             await logout(request)
-        return {"username": username, "id": user_id}
+            return None
+        return await get_principal(user_id)
     except JWTError:
         raise HTTPException(status_code=404, detail="Not Found")
 
 
 @router.post("/token")
 async def login_for_access_token(response: Response, form_data: OAuth2PasswordRequestForm = Depends(),
-                                 db: Session = Depends(get_db)):
+                                 db: AsyncSession = Depends(get_db)):
     """
     Log in the user and create an access token.
     """
-    user = authenticate_user(form_data.username, form_data.password, db)
+    user = await authenticate_user(form_data.username, form_data.password, db)
     if not user:
         return False
     token_expires = timedelta(minutes=60)
@@ -131,7 +204,7 @@ async def authenticationpage(request: Request):
 
 
 @router.post("/", response_class=HTMLResponse)
-async def login(request: Request, db: Session = Depends(get_db)):
+async def login(request: Request, db: AsyncSession = Depends(get_db)):
     """
     Handle user login.
     """
@@ -172,12 +245,12 @@ async def register(request: Request):
 @router.post("/register", response_class=HTMLResponse)
 async def register_user(request: Request, email: str = Form(...), username: str = Form(...),
                         firstname: str = Form(...), lastname: str = Form(...), password: str = Form(...),
-                        password2: str = Form(...), db: Session = Depends(get_db)):
+                        password2: str = Form(...), db: AsyncSession = Depends(get_db)):
     """
     Register a new user.
     """
-    validation1 = db.query(models.Users).filter(models.Users.username == username).first()
-    validation2 = db.query(models.Users).filter(models.Users.email == email).first()
+    validation1 = await crud.get_user_by_username(db, username)
+    validation2 = await crud.get_user_by_email(db, email)
 
     if password != password2 or validation1 is not None or validation2 is not None:
         msg = "Invalid registration request"
@@ -189,12 +262,12 @@ async def register_user(request: Request, email: str = Form(...), username: str
     user_model.first_name = firstname
     user_model.last_name = lastname
 
-    hash_password = get_password_hash(password)
+    hash_password = await get_password_hash(password)
     user_model.hashed_password = hash_password
     user_model.is_active = True
 
     db.add(user_model)
-    db.commit()
+    await db.commit()
 
     msg = "User successfully created"
     return templates.TemplateResponse("login.html", {"request": request, "msg": msg})
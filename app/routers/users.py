@@ -1,11 +1,11 @@
-from .. import models
+from .. import crud, models
 from ..database import engine, get_db
 from .auth import get_current_user, get_password_hash, verify_password
 
 from fastapi import APIRouter, Depends, Form, Request
 from fastapi.responses import HTMLResponse
 from fastapi.templating import Jinja2Templates
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from starlette import status
 from starlette.responses import RedirectResponse
 
@@ -35,7 +35,7 @@ async def edit_user_view(request: Request):
 @router.post("/change-password", response_class=HTMLResponse)
 async def user_password_change(request: Request, old_password: str = Form(...),
                                password: str = Form(...),
-                               password2: str = Form(...), db: Session = Depends(get_db)):
+                               password2: str = Form(...), db: AsyncSession = Depends(get_db)):
     """
     Change the user's password if the old password is verified.
     """
@@ -43,13 +43,13 @@ async def user_password_change(request: Request, old_password: str = Form(...),
     if user is None:
         return RedirectResponse(url="/auth", status_code=status.HTTP_302_FOUND)
 
-    user_data = db.query(models.Users).filter(models.Users.id == user.get("id")).first()
+    user_data = await crud.get_user(db, user.id)
     msg = "Invalid password"
     if user_data is not None:
-        if password == password2 and verify_password(old_password, user_data.hashed_password):
-            user_data.hashed_password = get_password_hash(password)
+        if password == password2 and await verify_password(old_password, user_data.hashed_password):
+            user_data.hashed_password = await get_password_hash(password)
             db.add(user_data)
-            db.commit()
+            await db.commit()
             msg = 'Password updated'
 
     return templates.TemplateResponse("change-password.html", {"request": request, "user": user, "msg": msg})
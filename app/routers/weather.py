@@ -1,11 +1,21 @@
+import asyncio
+import csv
+import io
+from datetime import datetime, timezone
+from typing import AsyncIterator, Literal, Optional
+
+import msgspec
+import orjson
 from fastapi import APIRouter, Depends, HTTPException, Request, Form
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from starlette import status
 from starlette.responses import RedirectResponse
 from app import schemas, models, database, crud, utils
+from app.config import settings
 
 from app.email_utils import check_alerts
-from app.routers.auth import get_current_user
+from app.routers.auth import get_current_user, principal_cache
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from starlette.responses import HTMLResponse
 from starlette.templating import Jinja2Templates
 
@@ -17,7 +27,7 @@ templates = Jinja2Templates(directory="templates")
 
 
 @router.get("/", response_class=HTMLResponse, name="main_page")
-async def weather_main_page(request: Request, db: Session = Depends(database.get_db)):
+async def weather_main_page(request: Request, db: AsyncSession = Depends(database.get_db)):
     """
     Render the main weather page displaying favorite cities.
     """
@@ -25,13 +35,22 @@ async def weather_main_page(request: Request, db: Session = Depends(database.get
 
     if user is None:
         return RedirectResponse(url="/auth", status_code=status.HTTP_302_FOUND)
-    favorite_cities = crud.get_favorite_locations(db, user_id=user.get("id"))
-    db_user = crud.get_user(db, user.get("id"))
+    favorite_cities = await crud.get_favorite_locations(db, user_id=user.id)
+
+    # Current conditions for every favorite, in about one upstream round-trip
+    try:
+        favorite_weather, city_ids = await asyncio.wait_for(utils.get_favorites_weather(favorite_cities),
+                                                            timeout=settings.WEATHER_PAGE_BUDGET_SECONDS)
+    except asyncio.TimeoutError:
+        favorite_weather, city_ids = {}, {}
+    # Remember newly learned city IDs so that these favorites join the grouped lookup next time
+    await crud.set_owm_city_ids(db, city_ids)
 
     return templates.TemplateResponse("main_page.html", {
         "request": request,
         "favorite_cities": favorite_cities,
-        "user": db_user
+        "favorite_weather": favorite_weather,
+        "user": user
     })
 
 
@@ -40,6 +59,9 @@ async def get_weather(request: Request, city: str,
                       user=Depends(get_current_user)):
     """
     Fetch and display the current weather for a given city.
+
+    Current weather and the forecast are fetched concurrently. If the forecast is not ready
+    within WEATHER_PAGE_BUDGET_SECONDS, the page is rendered without the rain forecast.
     """
     if user is None:
         return RedirectResponse(url="/auth", status_code=status.HTTP_302_FOUND)
@@ -49,19 +71,35 @@ async def get_weather(request: Request, city: str,
     except HTTPException as e:
         return RedirectResponse(url=f"/weather/?error={e.detail}", status_code=status.HTTP_302_FOUND)
 
-    weather_data = await utils.get_current_weather(lat, lon)
+    # Only the geocoding is a real dependency: fetch current weather and forecast concurrently
+    deadline = asyncio.get_running_loop().time() + settings.WEATHER_PAGE_BUDGET_SECONDS
+    forecast_task = asyncio.create_task(utils.get_forecast_frame(lat, lon))
+    try:
+        weather_data = await utils.get_current_weather(lat, lon)
+    except BaseException:
+        forecast_task.cancel()
+        raise
     if weather_data is None:
+        forecast_task.cancel()
         return RedirectResponse(url=f"/weather/?error=Weather data not found for '{city}'.",
                                 status_code=status.HTTP_302_FOUND)
 
-    forecast_data = await utils.get_5_day_forecast(lat, lon)
-
-    # Call the function to check if it will rain today
-    will_rain, total_rain_volume, rain_times = utils.will_it_rain_today(forecast_data)
+    # Render without the rain section if the forecast fails or misses the page's latency budget
+    try:
+        remaining = deadline - asyncio.get_running_loop().time()
+        forecast_frame = await asyncio.wait_for(forecast_task, timeout=max(remaining, 0))
+    except Exception:
+        forecast_frame = None
+
+    will_rain, total_rain_volume, rain_times = False, 0.0, []
+    if forecast_frame is not None:
+        # Call the function to check if it will rain today
+        will_rain, total_rain_volume, rain_times = utils.will_it_rain_today(forecast_frame)
     return templates.TemplateResponse("weather_details.html", {
         "request": request,
         "city": city,
         "weather": weather_data,
+        "rain_forecast_available": forecast_frame is not None,
         "will_rain": will_rain,
         "rain_volume": total_rain_volume,
         "rain_times": rain_times,
@@ -70,7 +108,7 @@ async def get_weather(request: Request, city: str,
 
 
 @router.post("/favorite_city/", response_class=RedirectResponse)
-async def add_favorite_city(city: schemas.FavoriteLocationBase, db: Session = Depends(database.get_db),
+async def add_favorite_city(city: schemas.FavoriteLocationBase, db: AsyncSession = Depends(database.get_db),
                             user=Depends(get_current_user)):
     """
     Add a city to the user's favorite locations.
@@ -78,9 +116,9 @@ async def add_favorite_city(city: schemas.FavoriteLocationBase, db: Session = De
     if user is None:
         return RedirectResponse(url="/auth", status_code=status.HTTP_302_FOUND)
 
-    user_id = user.get("id")
+    user_id = user.id
 
-    if crud.favorite_location_exists(db, user_id=user_id, city_name=city.name):
+    if await crud.favorite_location_exists(db, user_id=user_id, city_name=city.name):
         error_message = "City already in favorites."
         return RedirectResponse(url=f"/weather/?error_favorite={error_message}", status_code=status.HTTP_302_FOUND)
 
@@ -90,14 +128,15 @@ async def add_favorite_city(city: schemas.FavoriteLocationBase, db: Session = De
         error_message = f"City not found: {city.name}"
         return RedirectResponse(url=f"/weather/?error_favorite={error_message}", status_code=status.HTTP_302_FOUND)
 
-    crud.create_favorite_location(db=db, user_id=user_id, city_name=city.name,
-                                  latitude=latitude, longitude=longitude)
+    await crud.create_favorite_location(db=db, user_id=user_id, city_name=city.name,
+                                        latitude=latitude, longitude=longitude)
 
     return RedirectResponse(url="/weather/", status_code=status.HTTP_302_FOUND)
 
 
 @router.post("/favorite_city/{city_name}/delete", response_class=RedirectResponse)
-def delete_favorite_city(city_name: str, db: Session = Depends(database.get_db), user=Depends(get_current_user)):
+async def delete_favorite_city(city_name: str, db: AsyncSession = Depends(database.get_db),
+                               user=Depends(get_current_user)):
     """
     Deletes a city from the user's list of favorite locations.
     """
@@ -105,49 +144,76 @@ def delete_favorite_city(city_name: str, db: Session = Depends(database.get_db),
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated")
 
     # Find the favorite city in the user's list
-    favorite_location = db.query(models.FavoriteLocation).filter(
-        models.FavoriteLocation.name == city_name,
-        models.FavoriteLocation.owner_id == user.get("id")
-    ).first()
+    favorite_location = await crud.get_favorite_location_by_name(db, user_id=user.id, city_name=city_name)
 
     # If the city is not found, raise an error
     if not favorite_location:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="City not found in favorite locations")
 
     # Delete the city from the database
-    db.delete(favorite_location)
-    db.commit()
+    await db.delete(favorite_location)
+    await db.commit()
 
     # Redirect back to the main page after deletion
     return RedirectResponse(url="/weather", status_code=status.HTTP_302_FOUND)
 
 
-@router.get("/rain-forecast/{city}")
-async def get_rain_forecast(city: str):
+# Fields of the rain forecast response that can be selected with ?fields=
+RAIN_FORECAST_FIELDS = ("city", "will_rain", "rain_volume", "rain_period", "weather")
+
+
+@router.get("/rain-forecast/{city}", response_class=ORJSONResponse)
+async def get_rain_forecast(city: str, fields: Optional[str] = None):
     """
     Get rain forecast for the specified city.
+
+    Pass a comma-separated `fields` list (e.g. `?fields=will_rain,rain_volume,rain_period`) to get
+    only those fields. The forecast entries (`weather`) are only included when they are selected
+    or when no fields are given; they hold the fields of app.upstream.Forecast, not the full
+    upstream payload.
     """
+    selected = [field.strip() for field in fields.split(",") if field.strip()] if fields else list(RAIN_FORECAST_FIELDS)
+    unknown = [field for field in selected if field not in RAIN_FORECAST_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f"Unknown fields: {', '.join(unknown)}. "
+                                   f"Available fields: {', '.join(RAIN_FORECAST_FIELDS)}.")
+
     lat, lon = await utils.get_coordinates(city)
-    forecast_data = await utils.get_5_day_forecast(lat, lon)
+    forecast_data, forecast_frame = await utils.get_forecast_and_frame(lat, lon)
 
     if forecast_data:
-        will_rain, total_rain_volume, rain_period = utils.will_it_rain_today(forecast_data)
-        return {
+        will_rain, total_rain_volume, rain_period = utils.will_it_rain_today(forecast_frame)
+        response = {
             "city": city,
             "will_rain": will_rain,
             "rain_volume": total_rain_volume,
             "rain_period": rain_period,
-            "weather": forecast_data
         }
+        if "weather" in selected:
+            # Already typed, so msgspec encodes it and orjson embeds the bytes as they are
+            response["weather"] = orjson.Fragment(msgspec.json.encode(forecast_data))
+        # Serialize directly with orjson, skipping FastAPI's generic encoding of the upstream payload
+        return ORJSONResponse({field: response[field] for field in selected})
     else:
-        return {"error": "Failed to retrieve weather data."}
+        return ORJSONResponse({"error": "Failed to retrieve weather data."})
+
+
+@router.get("/forecast-summary/{city}", response_model=schemas.ForecastSummary)
+async def get_forecast_summary(city: str):
+    """
+    Get a per-day summary of the 5-day forecast for the specified city.
+    """
+    lat, lon = await utils.get_coordinates(city)
+    days = await utils.get_forecast_summary(lat, lon)
+    return schemas.ForecastSummary(city=city, days=days)
 
 
 @router.post("/send-severe-weather-alert/")
 async def check_and_send_alerts(
         request: Request,
         city: str = Form(...),
-        db: Session = Depends(database.get_db)
+        db: AsyncSession = Depends(database.get_db)
 ):
     """
     Check for severe weather in the user's favorite cities and send an alert via email.
@@ -165,57 +231,114 @@ async def check_and_send_alerts(
 
         subject = f"Severe Weather Alert for {city}!"
         body = (
-            f"Dear {user['username']},\n\n"
+            f"Dear {user.username},\n\n"
             f"Severe weather conditions are expected in {city}.\n"
             f"Details:\n{alert_message}\n\n"
             f"Please stay safe and take precautions.\n\n"
             f"Best regards,\nThe Weather App Team"
         )
         # Send the email
-        check_alerts(user.get('id'), db, subject, body)
+        await check_alerts(user.id, db, subject, body)
 
-        return {"message": f"Severe weather alert sent to {user.get('username')}"}
+        return {"message": f"Severe weather alert sent to {user.username}"}
 
     return {"message": "No severe weather detected."}
 
 
 @router.post("/toggle-auto-check")
 async def toggle_auto_check(
-        db: Session = Depends(database.get_db),
-        current_user: models.Users = Depends(get_current_user)
+        db: AsyncSession = Depends(database.get_db),
+        current_user: schemas.Principal = Depends(get_current_user)
 ):
     """
     Toggle the auto_check_enabled flag for the current user.
     """
     try:
-        user = current_user
-        user = crud.get_user(db, user.get('id'))
-        user.auto_check_enabled = not user.auto_check_enabled
-        db.add(user)
-        db.commit()
-        db.refresh(user)
+        enabled = await crud.toggle_auto_check(db, current_user.id)
+        if enabled is not None:
+            principal_cache.set(current_user.id, current_user.model_copy(update={"auto_check_enabled": enabled}))
         return RedirectResponse(url="/weather/", status_code=status.HTTP_302_FOUND)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error toggling auto-check: {str(e)}")
 
 
 @router.post("/favorite_city/{city_id}/toggle_alert")
-def toggle_send_alert(city_id: int, db: Session = Depends(database.get_db),
-                      current_user: models.Users = Depends(get_current_user)):
+async def toggle_send_alert(city_id: int, db: AsyncSession = Depends(database.get_db),
+                            current_user: schemas.Principal = Depends(get_current_user)):
     """
     Toggle the alert flag for a favorite city.
     """
     # Get the favorite location by ID and ensure it belongs to the current user
-    favorite_location = db.query(models.FavoriteLocation).filter(
-        models.FavoriteLocation.id == city_id,
-        models.FavoriteLocation.owner_id == current_user.get('id')
-    ).first()
+    favorite_location = await crud.get_favorite_location(db, user_id=current_user.id, location_id=city_id)
 
     if not favorite_location:
         raise HTTPException(status_code=404, detail="Favorite city not found")
 
-    # Toggle the send_alert value
-    favorite_location.send_alert = not favorite_location.send_alert
-    db.commit()
+    await crud.toggle_send_alert(db, favorite_location)
 
     return RedirectResponse(url="/weather/", status_code=status.HTTP_302_FOUND)
+
+
+# Observation tables that can be exported, by resolution
+EXPORT_TABLES = {
+    "raw": models.WeatherObservation.__table__,
+    "hourly": models.HourlyObservation.__table__,
+    "daily": models.DailyObservation.__table__,
+}
+EXPORT_MEDIA_TYPES = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+
+@router.get("/history/{city}/export")
+async def export_history(city: str, format: Literal["csv", "ndjson"] = "csv",
+                         resolution: Literal["raw", "hourly", "daily"] = "raw",
+                         start: Optional[datetime] = None, end: Optional[datetime] = None,
+                         user=Depends(get_current_user)):
+    """
+    Export the stored observations for the grid cell of a city as CSV or NDJSON.
+
+    `resolution` selects raw sweep observations or the hourly or daily rollups, and `start`/`end`
+    limit the export to a time range (timestamps without a timezone are taken as UTC). Rows are
+    streamed as they are read from the database, so exports of any size use constant memory.
+    """
+    if user is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated")
+
+    lat, lon = await utils.get_coordinates(city)
+    cell = utils.grid_cell(lat, lon)
+    rows = _encode_history(EXPORT_TABLES[resolution], cell, format, _unix_time(start), _unix_time(end))
+    filename = f"{cell}-{resolution}.{format}"
+    return StreamingResponse(rows, media_type=EXPORT_MEDIA_TYPES[format],
+                             headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+
+def _unix_time(moment: Optional[datetime]) -> Optional[int]:
+    """
+    Convert a datetime to Unix time, treating naive datetimes as UTC.
+    """
+    if moment is None:
+        return None
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return int(moment.timestamp())
+
+
+async def _encode_history(table, cell: str, format: str, start: Optional[int], end: Optional[int]) -> AsyncIterator[bytes]:
+    """
+    Read observation rows in batches and encode each batch as one chunk of the response.
+    """
+    # The response outlives the request's dependencies, so the export opens its own session
+    async with database.AsyncSessionLocal() as db:
+        batches = crud.stream_observations(db, table, cell, start, end, batch_size=settings.EXPORT_BATCH_SIZE)
+        if format == "csv":
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(table.columns.keys())
+            yield buffer.getvalue().encode()
+            async for batch in batches:
+                buffer.seek(0)
+                buffer.truncate()
+                writer.writerows(batch)
+                yield buffer.getvalue().encode()
+        else:
+            async for batch in batches:
+                yield b"".join(orjson.dumps(row._asdict(), option=orjson.OPT_APPEND_NEWLINE) for row in batch)
@@ -1,4 +1,7 @@
-from pydantic import BaseModel
+from datetime import date
+from typing import List, Optional
+
+from pydantic import BaseModel, ConfigDict
 
 
 class WeatherDataBase(BaseModel):
@@ -20,6 +23,23 @@ class WeatherData(BaseModel):
     humidity: int
     weather_description: str
     wind_speed: float
+    city_id: Optional[int] = None
+    observed_at: Optional[int] = None
+
+
+class DailyForecastSummary(BaseModel):
+    date: date
+    temp_min: float
+    temp_max: float
+    rain_volume: float
+    rain_windows: List[str]
+    wind_max: float
+    condition: str
+
+
+class ForecastSummary(BaseModel):
+    city: str
+    days: List[DailyForecastSummary]
 
 
 class UserBase(BaseModel):
@@ -38,6 +58,15 @@ class User(UserBase):
     is_active: bool
 
 
+class Principal(User):
+    """
+    The signed-in user as seen by the pages, cached between requests.
+    """
+    model_config = ConfigDict(from_attributes=True, frozen=True)
+
+    auto_check_enabled: bool
+
+
 class Login(BaseModel):
     email: str
     password: str
@@ -54,8 +83,8 @@ class FavoriteLocationCreate(FavoriteLocationBase):
 class FavoriteLocation(FavoriteLocationBase):
     id: int
     owner_id: int
-    latitude: str
-    longitude: str
+    latitude: float
+    longitude: float
     name: str
 
 
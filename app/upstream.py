@@ -0,0 +1,92 @@
+"""
+Typed structs for the OpenWeatherMap payloads the app uses.
+
+Response bodies are decoded straight from bytes into these structs. Fields that are not
+declared here are skipped while decoding instead of being materialized as Python objects.
+"""
+from typing import List, Optional
+
+import msgspec
+
+
+class _Struct(msgspec.Struct, omit_defaults=True):
+    """
+    Base for upstream structs; fields left at their defaults are omitted when re-encoded.
+    """
+
+
+class GeocodeResult(_Struct):
+    lat: float
+    lon: float
+
+
+class Condition(_Struct):
+    id: int = 0
+    main: str = ""
+    description: str = ""
+
+
+class Main(_Struct):
+    temp: float
+    humidity: int = 0
+    pressure: int = 0
+
+
+class Wind(_Struct):
+    speed: float = 0.0
+
+
+class Clouds(_Struct):
+    all: int = 0
+
+
+class Coord(_Struct):
+    lat: float = 0.0
+    lon: float = 0.0
+
+
+class Sys(_Struct):
+    sunrise: Optional[int] = None
+    sunset: Optional[int] = None
+
+
+class Rain(_Struct):
+    one_hour: float = msgspec.field(default=0.0, name="1h")
+    three_hours: float = msgspec.field(default=0.0, name="3h")
+
+
+class CurrentWeather(_Struct):
+    main: Main
+    weather: List[Condition]
+    id: int = 0
+    dt: int = 0
+    name: str = ""
+    coord: Coord = msgspec.field(default_factory=Coord)
+    wind: Wind = msgspec.field(default_factory=Wind)
+    clouds: Clouds = msgspec.field(default_factory=Clouds)
+    rain: Rain = msgspec.field(default_factory=Rain)
+    sys: Sys = msgspec.field(default_factory=Sys)
+    visibility: Optional[int] = None
+
+
+class GroupWeather(_Struct):
+    list: List[CurrentWeather]
+
+
+class ForecastEntry(_Struct):
+    dt: int
+    main: Main
+    weather: List[Condition]
+    # Optional so that entries without them are re-encoded without empty objects
+    wind: Optional[Wind] = None
+    rain: Optional[Rain] = None
+
+
+class Forecast(_Struct):
+    list: List[ForecastEntry]
+
+
+geocode_decoder = msgspec.json.Decoder(List[GeocodeResult])
+current_weather_decoder = msgspec.json.Decoder(CurrentWeather)
+group_weather_decoder = msgspec.json.Decoder(GroupWeather)
+forecast_decoder = msgspec.json.Decoder(Forecast)
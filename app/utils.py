@@ -1,105 +1,393 @@
-from datetime import datetime, timedelta
-from typing import List, Tuple, Optional, Dict, Union
+import asyncio
+from datetime import date, datetime, timedelta
+from typing import List, Tuple, Optional, Dict, Union, Hashable, Iterable
 
-import httpx
-import requests
+import msgspec
 from fastapi import HTTPException
 
-from . import schemas
+from . import crud, geo, metrics, models, schemas, upstream
+from .cache import MISSING, SingleFlight, TTLCache
 from .config import settings
+from .database import AsyncSessionLocal
+from .forecast import ForecastFrame
+from .http_client import fetch
+
+
+# In-process tier of the geocode cache; None values record cities that were not found
+geocode_cache = TTLCache(maxsize=settings.GEOCODE_CACHE_SIZE, ttl=settings.GEOCODE_CACHE_TTL)
+
+# Weather caches keyed by grid cell, shared by the web routes and the alert sweep
+current_weather_cache = TTLCache(maxsize=settings.WEATHER_CACHE_SIZE, ttl=settings.CURRENT_WEATHER_CACHE_TTL)
+# Forecasts are cached as (Forecast, ForecastFrame) pairs, so a frame never outlives its forecast
+forecast_cache = TTLCache(maxsize=settings.WEATHER_CACHE_SIZE, ttl=settings.FORECAST_CACHE_TTL)
+forecast_summary_cache = TTLCache(maxsize=settings.WEATHER_CACHE_SIZE, ttl=settings.FORECAST_CACHE_TTL)
+
+# OpenWeatherMap accepts at most this many city IDs in one group lookup
+GROUP_MAX_IDS = 20
+
+# Coalesces identical concurrent upstream lookups, e.g. many users loading the same city during a storm
+upstream_calls = SingleFlight()
+
+# Caches reported by /metrics, by name
+caches = {
+    "geocode": geocode_cache,
+    "current_weather": current_weather_cache,
+    "forecast": forecast_cache,
+    "forecast_summary": forecast_summary_cache,
+}
+
+
+def _cache_hit_ratios() -> Dict[Tuple[str], float]:
+    ratios = {}
+    for name, cache in caches.items():
+        lookups = cache.hits + cache.misses
+        ratios[(name,)] = cache.hits / lookups if lookups else 0.0
+    return ratios
+
+
+metrics.counter("cache_hits_total", "In-process cache lookups that found a fresh entry.", ("cache",),
+                callback=lambda: {(name,): cache.hits for name, cache in caches.items()})
+metrics.counter("cache_misses_total", "In-process cache lookups that found no fresh entry.", ("cache",),
+                callback=lambda: {(name,): cache.misses for name, cache in caches.items()})
+metrics.gauge("cache_hit_ratio", "Share of in-process cache lookups that were hits since startup.", ("cache",),
+              callback=_cache_hit_ratios)
+metrics.gauge("cache_entries", "Entries currently held by each in-process cache.", ("cache",),
+              callback=lambda: {(name,): len(cache) for name, cache in caches.items()})
+metrics.counter("upstream_singleflight_calls_total", "Upstream lookups started by the single-flight group.",
+                callback=lambda: upstream_calls.calls)
+metrics.counter("upstream_singleflight_coalesced_total",
+                "Upstream lookups that joined a call already in flight instead of starting one.",
+                callback=lambda: upstream_calls.coalesced)
+
+
+def grid_cell(lat: float, lon: float) -> str:
+    """
+    Geohash cell of the configured precision, so that nearby lookups share cached weather.
+    """
+    return geo.encode(float(lat), float(lon), settings.WEATHER_CELL_PRECISION)
+
+
+def location_cell(location: models.FavoriteLocation) -> str:
+    """
+    Grid cell of a favorite location, taken from its stored geohash when it has one.
+    """
+    if location.geohash:
+        return location.geohash[:settings.WEATHER_CELL_PRECISION]
+    return grid_cell(location.latitude, location.longitude)
+
+
+def normalize_geocode_query(query: str) -> str:
+    """
+    Normalize a geocoding query so that spelling variants like " London , GB" share one cache key.
+    """
+    return ",".join(" ".join(part.split()) for part in query.lower().split(","))
 
 
 async def get_coordinates(city: str, state: Optional[str] = None, country: Optional[str] = None) -> Tuple[float, float]:
     """
     Fetch the geographic coordinates (latitude and longitude) of a city.
+
+    Results are looked up in the in-process cache first, then in the database cache,
+    and only then requested from the API. Concurrent misses for the same query share one lookup.
+    """
+    query = normalize_geocode_query(f"{city},{state},{country}" if state and country else city)
+
+    coordinates = geocode_cache.get(query)
+    if coordinates is MISSING:
+        coordinates = await upstream_calls.do(("geocode", query), lambda: _resolve_coordinates(query))
+
+    if coordinates is None:
+        raise HTTPException(status_code=404, detail="City not found.")
+    return coordinates
+
+
+async def _resolve_coordinates(query: str) -> Optional[Tuple[float, float]]:
+    """
+    Resolve a query missing from the in-process cache, from the database cache or the API.
+
+    The database cache is an optimization only: if it cannot be read, the API is asked instead.
+    """
+    try:
+        async with AsyncSessionLocal() as db:
+            db_geocode = await crud.get_geocode(db, query)
+    except Exception as e:
+        print(f"Error reading cached coordinates for {query}: {e}")
+        db_geocode = None
+    if db_geocode is not None:
+        coordinates = None if db_geocode.latitude is None else (db_geocode.latitude, db_geocode.longitude)
+        await _remember_coordinates(query, coordinates, persist=False)
+        return coordinates
+
+    coordinates = await _fetch_coordinates(query)
+    await _remember_coordinates(query, coordinates)
+    return coordinates
+
+
+async def _remember_coordinates(query: str, coordinates: Optional[Tuple[float, float]], persist: bool = True) -> None:
+    """
+    Store a geocoding result in the cache tiers, using the shorter TTL for cities that were not found.
+    """
+    ttl = settings.GEOCODE_CACHE_TTL if coordinates is not None else settings.GEOCODE_NEGATIVE_CACHE_TTL
+    geocode_cache.set(query, coordinates, ttl=ttl)
+    if persist:
+        lat, lon = coordinates if coordinates is not None else (None, None)
+        try:
+            async with AsyncSessionLocal() as db:
+                await crud.save_geocode(db, query, lat, lon, ttl)
+        except Exception as e:
+            # The answer is already in hand; failing to cache it must not fail the request
+            print(f"Error caching coordinates for {query}: {e}")
+
+
+async def _fetch_coordinates(query: str) -> Optional[Tuple[float, float]]:
+    """
+    Request the coordinates of a normalized city query from the geocoding API.
+    Returns None if the city was not found.
     """
     geocode_params = {
-        "q": f"{city},{state},{country}" if state and country else city,
+        "q": query,
         "limit": 1,
         "appid": settings.API_KEY
     }
 
-    async with httpx.AsyncClient() as client:
-        response = await client.get("http://api.openweathermap.org/geo/1.0/direct", params=geocode_params)
+    response = await fetch("/geo/1.0/direct", params=geocode_params)
 
     if response.status_code != 200:
         raise HTTPException(status_code=response.status_code, detail="Failed to fetch coordinates.")
 
-    geocode_data = response.json()
-    if not geocode_data or len(geocode_data) == 0:
-        raise HTTPException(status_code=404, detail="City not found.")
-    if 'lat' not in geocode_data[0] or 'lon' not in geocode_data[0]:
+    try:
+        geocode_data = upstream.geocode_decoder.decode(response.content)
+    except msgspec.ValidationError:
         raise HTTPException(status_code=500, detail="Incomplete geocode data returned by the API.")
+    if not geocode_data:
+        return None
 
     # Return the latitude and longitude
-    return geocode_data[0]['lat'], geocode_data[0]['lon']
+    return geocode_data[0].lat, geocode_data[0].lon
 
 
 async def get_current_weather(lat: float, lon: float) -> schemas.WeatherData:
     """
     Fetch the current weather data for the given latitude and longitude.
+
+    Results are cached per grid cell for CURRENT_WEATHER_CACHE_TTL seconds, and concurrent
+    misses for the same cell share one upstream call.
     """
-    current_weather_url = (
-        f"http://api.openweathermap.org/data/2.5/weather?lat={lat}&lon={lon}&appid={settings.API_KEY}&units=metric"
-    )
+    cell = grid_cell(lat, lon)
+    weather = current_weather_cache.get(cell)
+    if weather is MISSING:
+        weather = await upstream_calls.do(("current_weather", cell),
+                                          lambda: _fetch_current_weather(lat, lon, cell))
+    return weather.model_copy(update={"latitude": float(lat), "longitude": float(lon)})
+
+
+async def _fetch_current_weather(lat: float, lon: float, cell: Hashable) -> schemas.WeatherData:
+    """
+    Request current weather from the API and cache it for its grid cell.
+    """
+    weather_params = {
+        "lat": lat,
+        "lon": lon,
+        "appid": settings.API_KEY,
+        "units": "metric"
+    }
 
-    async with httpx.AsyncClient() as client:
-        response = await client.get(current_weather_url)
+    response = await fetch("/data/2.5/weather", params=weather_params)
 
     if response.status_code != 200:
         raise HTTPException(status_code=response.status_code, detail="Failed to fetch current weather data.")
 
-    weather_data = response.json()
-    if "main" not in weather_data:
+    try:
+        weather_data = upstream.current_weather_decoder.decode(response.content)
+    except msgspec.ValidationError:
         raise HTTPException(status_code=500, detail="Error fetching weather data")
 
-    weather = schemas.WeatherData(
-        city=weather_data["name"],
-        temperature=weather_data["main"]["temp"],
-        condition=weather_data["weather"][0]["main"],
-        wind_speed=weather_data["wind"]["speed"],
-        latitude=lat,
-        longitude=lon,
-        humidity=weather_data["main"]["humidity"],
-        weather_description=weather_data["weather"][0]["description"]
+    weather = _weather_from_struct(weather_data, lat, lon)
+    current_weather_cache.set(cell, weather)
+    if weather.city_id is not None:
+        current_weather_cache.set(("city", weather.city_id), weather)
+    return weather
+
+
+def _weather_from_struct(weather_data: upstream.CurrentWeather, lat: float, lon: float) -> schemas.WeatherData:
+    """
+    Build the weather model from decoded current conditions.
+    """
+    # The decoded struct is already typed, so the model is built without a second validation pass
+    condition = weather_data.weather[0] if weather_data.weather else upstream.Condition()
+    return schemas.WeatherData.model_construct(
+        city=weather_data.name,
+        temperature=weather_data.main.temp,
+        condition=condition.main,
+        wind_speed=weather_data.wind.speed,
+        latitude=float(lat),
+        longitude=float(lon),
+        humidity=weather_data.main.humidity,
+        weather_description=condition.description,
+        city_id=weather_data.id or None,
+        observed_at=weather_data.dt or None
     )
 
+
+async def get_current_weather_for_cities(city_ids: Iterable[int]) -> Dict[int, schemas.WeatherData]:
+    """
+    Fetch current weather for many OpenWeatherMap city IDs in as few upstream calls as possible.
+
+    Cached cities are served from the current weather cache. The rest are requested in groups of
+    up to GROUP_MAX_IDS IDs, all groups at once. Cities missing from the response are left out.
+    """
+    weather = {}
+    missing = []
+    for city_id in dict.fromkeys(city_ids):
+        cached = current_weather_cache.get(("city", city_id))
+        if cached is MISSING:
+            missing.append(city_id)
+        else:
+            weather[city_id] = cached
+
+    groups = [tuple(missing[i:i + GROUP_MAX_IDS]) for i in range(0, len(missing), GROUP_MAX_IDS)]
+    for fetched in await asyncio.gather(*(
+        upstream_calls.do(("group_weather", group), lambda group=group: _fetch_group_weather(group))
+        for group in groups
+    )):
+        weather.update(fetched)
     return weather
 
 
-def fetch_weather_data(lat: float, lon: float) -> Dict[str, Union[float, int, str]]:
+async def _fetch_group_weather(city_ids: Tuple[int, ...]) -> Dict[int, schemas.WeatherData]:
+    """
+    Request current weather for up to GROUP_MAX_IDS cities in one call and cache each city.
+    """
+    group_params = {
+        "id": ",".join(str(city_id) for city_id in city_ids),
+        "appid": settings.API_KEY,
+        "units": "metric"
+    }
+
+    response = await fetch("/data/2.5/group", params=group_params)
+
+    if response.status_code != 200:
+        raise HTTPException(status_code=response.status_code, detail="Failed to fetch current weather data.")
+
+    try:
+        group_data = upstream.group_weather_decoder.decode(response.content)
+    except msgspec.ValidationError:
+        raise HTTPException(status_code=500, detail="Error fetching weather data")
+
+    weather = {}
+    for city_data in group_data.list:
+        city_weather = _weather_from_struct(city_data, city_data.coord.lat, city_data.coord.lon)
+        current_weather_cache.set(("city", city_data.id), city_weather)
+        weather[city_data.id] = city_weather
+    return weather
+
+
+async def get_favorites_weather(
+        favorites: Iterable[models.FavoriteLocation]
+) -> Tuple[Dict[int, schemas.WeatherData], Dict[int, int]]:
+    """
+    Current weather for each favorite location, keyed by location ID.
+
+    Favorites with a known OpenWeatherMap city ID are looked up together through grouped calls.
+    The rest are looked up by coordinates, all at once, and the city IDs learned that way are
+    returned as a second mapping of location ID to city ID, so the caller can store them.
+    A favorite whose lookup fails is left out.
+    """
+    favorites = list(favorites)
+    known = [favorite for favorite in favorites if favorite.owm_city_id]
+    unknown = [favorite for favorite in favorites if not favorite.owm_city_id]
+
+    grouped, *located = await asyncio.gather(
+        get_current_weather_for_cities(favorite.owm_city_id for favorite in known),
+        *(get_current_weather(favorite.latitude, favorite.longitude) for favorite in unknown),
+        return_exceptions=True
+    )
+
+    weather = {}
+    if isinstance(grouped, Exception):
+        print(f"Error fetching weather for favorite cities: {grouped}")
+    else:
+        for favorite in known:
+            if favorite.owm_city_id in grouped:
+                weather[favorite.id] = grouped[favorite.owm_city_id]
+
+    city_ids = {}
+    for favorite, result in zip(unknown, located):
+        if isinstance(result, Exception):
+            print(f"Error fetching weather for {favorite.name}: {result}")
+            continue
+        weather[favorite.id] = result
+        if result.city_id is not None:
+            city_ids[favorite.id] = result.city_id
+    return weather, city_ids
+
+
+async def fetch_weather_data(lat: float, lon: float) -> Dict[str, Union[float, int, str]]:
     """
     Fetch weather data from OpenWeatherMap API.
     """
-    url = f"http://api.openweathermap.org/data/2.5/weather"
     params = {
         "lat": lat,
         "lon": lon,
         "appid": settings.API_KEY,
         "units": "metric"
     }
-    response = requests.get(url, params=params)
+    response = await fetch("/data/2.5/weather", params=params)
     if response.status_code == 200:
-        data = response.json()
+        data = upstream.current_weather_decoder.decode(response.content)
         return {
-            "temperature": data["main"]["temp"],
-            "description": data["weather"][0]["description"],
-            "humidity": data["main"]["humidity"],
-            "wind_speed": data["wind"]["speed"],
-            "pressure": data["main"]["pressure"],
-            "visibility": data.get("visibility"),
-            "rain": data.get("rain", {}).get("1h", 0),  # Rainfall in the last hour
-            "cloud_coverage": data["clouds"]["all"],  # Cloud coverage percentage
-            "sunrise": data["sys"].get("sunrise"),
-            "sunset": data["sys"].get("sunset")
+            "temperature": data.main.temp,
+            "description": data.weather[0].description,
+            "humidity": data.main.humidity,
+            "wind_speed": data.wind.speed,
+            "pressure": data.main.pressure,
+            "visibility": data.visibility,
+            "rain": data.rain.one_hour,  # Rainfall in the last hour
+            "cloud_coverage": data.clouds.all,  # Cloud coverage percentage
+            "sunrise": data.sys.sunrise,
+            "sunset": data.sys.sunset
         }
     else:
         raise Exception(f"Error fetching weather data: {response.status_code}")
 
 
-async def get_5_day_forecast(lat: float, lon: float, units: str = "metric") -> Dict:
+async def get_5_day_forecast(lat: float, lon: float, units: str = "metric") -> upstream.Forecast:
     """
     Fetch a 5-day weather forecast for the given latitude and longitude.
+
+    Results are cached per grid cell for FORECAST_CACHE_TTL seconds, and concurrent
+    misses for the same cell share one upstream call.
+    """
+    forecast, _ = await get_forecast_and_frame(lat, lon, units)
+    return forecast
+
+
+async def get_forecast_frame(lat: float, lon: float, units: str = "metric") -> ForecastFrame:
+    """
+    Get the 5-day forecast for the given coordinates as a columnar ForecastFrame.
+
+    The frame is built once per upstream forecast and cached in the same entry, so it always
+    matches the forecast returned by get_5_day_forecast.
+    """
+    _, frame = await get_forecast_and_frame(lat, lon, units)
+    return frame
+
+
+async def get_forecast_and_frame(lat: float, lon: float,
+                                 units: str = "metric") -> Tuple[upstream.Forecast, ForecastFrame]:
+    """
+    Get the 5-day forecast for the given coordinates together with its frame, from one cache entry.
+    """
+    key = (grid_cell(lat, lon), units)
+    entry = forecast_cache.get(key)
+    if entry is MISSING:
+        entry = await upstream_calls.do(("forecast", key), lambda: _fetch_forecast(lat, lon, units, key))
+    return entry
+
+
+async def _fetch_forecast(lat: float, lon: float, units: str, key: Hashable) -> Tuple[upstream.Forecast, ForecastFrame]:
+    """
+    Request a 5-day forecast from the API, build its frame and cache both for its grid cell.
     """
     forecast_params = {
         "lat": lat,
@@ -108,13 +396,18 @@ async def get_5_day_forecast(lat: float, lon: float, units: str = "metric") -> D
         "units": units
     }
 
-    async with httpx.AsyncClient() as client:
-        response = await client.get("http://api.openweathermap.org/data/2.5/forecast", params=forecast_params)
+    response = await fetch("/data/2.5/forecast", params=forecast_params)
 
     if response.status_code != 200:
         raise HTTPException(status_code=response.status_code, detail="Failed to fetch weather data.")
 
-    return response.json()
+    try:
+        forecast = upstream.forecast_decoder.decode(response.content)
+    except msgspec.ValidationError:
+        raise HTTPException(status_code=500, detail="Error fetching weather data")
+    entry = (forecast, ForecastFrame.from_forecast(forecast))
+    forecast_cache.set(key, entry)
+    return entry
 
 
 def categorize_time(dt: datetime) -> str:
@@ -132,60 +425,66 @@ def categorize_time(dt: datetime) -> str:
         return "night"
 
 
-def will_it_rain_today(forecast_data: Dict) -> Tuple[bool, float, List[str]]:
+def will_it_rain_today(forecast_data: Union[upstream.Forecast, ForecastFrame]) -> Tuple[bool, float, List[str]]:
     """
     Determine if it will rain today based on the forecast data.
     """
-    current_date = datetime.now().date()
-    rain_today = False
-    total_rain_volume = 0.0
-
-    rain_periods = []  # Store raw rain periods as tuples of (start_time, end_time)
-
-    for entry in forecast_data["list"]:
-        forecast_time = datetime.fromtimestamp(entry["dt"])
-        if forecast_time.date() == current_date:
-            weather_conditions = entry["weather"]
-            for condition in weather_conditions:
-                if "rain" in condition["description"].lower():
-                    rain_today = True
-                    rain_start_time = forecast_time
-                    rain_end_time = forecast_time + timedelta(hours=3)
+    frame = forecast_data if isinstance(forecast_data, ForecastFrame) else ForecastFrame.from_forecast(forecast_data)
+    rain_today, total_rain_volume, rain_periods = frame.rain_on(datetime.now().date())
 
-                    # Update total rain volume
-                    total_rain_volume += entry["rain"].get("3h", 0.0)
+    # Format combined rain periods for display
+    formatted_rain_periods = [format_rain_period(start_ts, end_ts) for start_ts, end_ts in rain_periods]
 
-                    # Append the rain period
-                    rain_periods.append((rain_start_time, rain_end_time))
-                    break
+    return rain_today, total_rain_volume, formatted_rain_periods
 
-    # Combine overlapping rain periods
-    combined_rain_periods = []
-    if rain_periods:
-        # Sort by start time
-        rain_periods.sort(key=lambda x: x[0])
 
-        # Initialize the first period
-        current_start, current_end = rain_periods[0]
+def format_rain_period(start_ts: int, end_ts: int) -> str:
+    """
+    Format a rain period given as Unix timestamps for display.
+    """
+    start, end = datetime.fromtimestamp(start_ts), datetime.fromtimestamp(end_ts)
+    return (f"{start.strftime('%I:%M %p')} ({categorize_time(start)}) - "
+            f"{end.strftime('%I:%M %p')} ({categorize_time(end)})")
 
-        for start, end in rain_periods[1:]:
-            if start <= current_end:  # Overlapping or contiguous
-                current_end = max(current_end, end)  # Extend the end time if necessary
-            else:
-                combined_rain_periods.append((current_start, current_end))
-                current_start, current_end = start, end
 
-        # Add the last period
-        combined_rain_periods.append((current_start, current_end))
+def summarize_forecast(frame: ForecastFrame) -> List[schemas.DailyForecastSummary]:
+    """
+    Summarize a forecast per day: temperature range, rain windows and volume, peak wind and dominant condition.
+    """
+    daily = frame.daily()
+    summaries = []
+    for index, day_number in enumerate(daily["days"].tolist()):
+        day = date(1970, 1, 1) + timedelta(days=day_number)
+        _, _, rain_periods = frame.rain_on(day)
+        code = int(daily["condition_code"][index])
+        summaries.append(schemas.DailyForecastSummary(
+            date=day,
+            temp_min=round(float(daily["temp_min"][index]), 1),
+            temp_max=round(float(daily["temp_max"][index]), 1),
+            rain_volume=round(float(daily["rain_volume"][index]), 1),
+            rain_windows=[format_rain_period(start_ts, end_ts) for start_ts, end_ts in rain_periods],
+            wind_max=round(float(daily["wind_max"][index]), 1),
+            condition=frame.condition_names.get(code, "Unknown")
+        ))
+    return summaries
+
+
+async def get_forecast_summary(lat: float, lon: float, units: str = "metric") -> List[schemas.DailyForecastSummary]:
+    """
+    Get the per-day summary of the 5-day forecast for the given coordinates.
 
-    # Format combined rain periods for display
-    formatted_rain_periods = []
-    for start, end in combined_rain_periods:
-        formatted_rain_periods.append(f"{start.strftime('%I:%M %p')} ({categorize_time(start)}) - "
-                                      f"{end.strftime('%I:%M %p')} ({categorize_time(end)})")
+    The summary is derived from the cached forecast without extra upstream calls, and is itself
+    cached until that forecast is replaced.
+    """
+    key = (grid_cell(lat, lon), units)
+    frame = await get_forecast_frame(lat, lon, units)
+    cached = forecast_summary_cache.get(key)
+    if cached is not MISSING and cached[0] is frame:
+        return cached[1]
 
-    total_rain_volume = round(total_rain_volume, 1)  # Round rain volume to 1 decimal
-    return rain_today, total_rain_volume, formatted_rain_periods
+    summary = summarize_forecast(frame)
+    forecast_summary_cache.set(key, (frame, summary))
+    return summary
 
 
 async def check_extreme_weather(lat: float, lon: float) -> dict:
@@ -227,5 +526,6 @@ async def check_extreme_weather(lat: float, lon: float) -> dict:
     else:
         return {
             "severe_weather": False,
+            "weather_data": weather_data,
             "alerts": [],
         }
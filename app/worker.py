@@ -0,0 +1,193 @@
+"""
+Background worker that runs the weather alert sweep.
+
+Start it with `python -m app.worker` on as many processes or machines as needed. The sweep's
+locations are split into SWEEP_SHARDS shards. Workers claim due shards through leases stored in
+the database and keep them alive with heartbeats, so each shard is swept by one worker at a time.
+When a worker dies its leases expire and the unfinished shards are picked up by the others.
+
+Workers also take turns, through another lease, to downsample old sweep observations into
+hourly and daily rollups every OBSERVATION_ROLLUP_INTERVAL_SECONDS.
+"""
+import asyncio
+import os
+import random
+import signal
+import socket
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from app import crud, database, email_utils, http_client, mailer, metrics, models
+from app.config import settings
+
+
+def _holder_id() -> str:
+    """
+    Identify this worker process in the lease table.
+    """
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def _lease_name(shard: int) -> str:
+    """
+    Name of the lease guarding one shard of the sweep.
+    """
+    return f"alert-sweep:{shard}/{settings.SWEEP_SHARDS}"
+
+
+async def _claim_shard(holder: str, shard: int) -> bool:
+    """
+    Try to claim a shard whose last sweep finished at least SWEEP_INTERVAL_SECONDS ago.
+    """
+    completed_before = datetime.now(timezone.utc) - timedelta(seconds=settings.SWEEP_INTERVAL_SECONDS)
+    try:
+        async with database.AsyncSessionLocal() as db:
+            return await crud.acquire_lease(db, _lease_name(shard), holder, settings.SWEEP_LEASE_TTL,
+                                            completed_before=completed_before)
+    except Exception as e:
+        print(f"Could not claim weather alert sweep shard {shard}: {e}")
+        return False
+
+
+async def _heartbeat(holder: str, shard: int) -> bool:
+    """
+    Renew the lease on a shard being swept, treating database errors as a lost lease.
+    """
+    try:
+        async with database.AsyncSessionLocal() as db:
+            return await crud.acquire_lease(db, _lease_name(shard), holder, settings.SWEEP_LEASE_TTL)
+    except Exception as e:
+        print(f"Could not renew the lease on weather alert sweep shard {shard}: {e}")
+        return False
+
+
+async def _release_shard(holder: str, shard: int, completed: bool) -> None:
+    """
+    Give up the lease on a shard, recording whether its sweep completed.
+    """
+    try:
+        async with database.AsyncSessionLocal() as db:
+            await crud.release_lease(db, _lease_name(shard), holder, completed=completed)
+    except Exception as e:
+        print(f"Could not release weather alert sweep shard {shard}: {e}")
+
+
+async def _sweep_shard(holder: str, shard: int) -> None:
+    """
+    Sweep one shard and mark it completed, so that it is not claimed again before the next interval.
+
+    A failed sweep releases the shard uncompleted instead, so any worker retries it on its next
+    claim attempt, SWEEP_LEASE_RENEW_INTERVAL seconds later.
+    """
+    try:
+        async with database.AsyncSessionLocal() as db:
+            await email_utils.check_all_users_weather_alerts(db, shard=shard, shards=settings.SWEEP_SHARDS)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        print(f"Weather alert sweep of shard {shard} failed: {e}")
+        await _release_shard(holder, shard, completed=False)
+        return
+    await _release_shard(holder, shard, completed=True)
+
+
+# Lease guarding the observation downsampling job
+ROLLUP_LEASE = "observation-rollup"
+
+
+async def _rollup_observations(holder: str) -> None:
+    """
+    Downsample old observations if no worker has done so within OBSERVATION_ROLLUP_INTERVAL_SECONDS.
+    """
+    interval = settings.OBSERVATION_ROLLUP_INTERVAL_SECONDS
+    now = datetime.now(timezone.utc)
+    try:
+        async with database.AsyncSessionLocal() as db:
+            # The lease outlives any run, so a worker that dies mid-run only delays the next one
+            if not await crud.acquire_lease(db, ROLLUP_LEASE, holder, interval,
+                                            completed_before=now - timedelta(seconds=interval)):
+                return
+            started = time.perf_counter()
+            # Cut off at whole hours and whole UTC days so every bucket is rolled up in one run
+            timestamp = int(now.timestamp())
+            raw_before = (timestamp - settings.OBSERVATION_RAW_RETENTION_DAYS * 86400) // 3600 * 3600
+            hourly_before = (timestamp - settings.OBSERVATION_HOURLY_RETENTION_DAYS * 86400) // 86400 * 86400
+            rolled_raw, rolled_hourly = await crud.downsample_observations(db, raw_before, hourly_before)
+            await crud.release_lease(db, ROLLUP_LEASE, holder, completed=True)
+            print(f"Rolled up {rolled_raw} observations into hourly buckets and {rolled_hourly} hourly "
+                  f"buckets into daily buckets in {time.perf_counter() - started:.2f}s.")
+    except Exception as e:
+        print(f"Observation rollup failed: {e}")
+
+
+async def run() -> None:
+    """
+    Claim due sweep shards, sweep them and keep their leases alive until done.
+    """
+    holder = _holder_id()
+    running: dict[int, asyncio.Task] = {}
+    rollup: Optional[asyncio.Task] = None
+
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    except NotImplementedError:
+        pass
+
+    metrics_server = None
+    if settings.WORKER_METRICS_PORT:
+        metrics_server = await metrics.serve(settings.WORKER_METRICS_HOST, settings.WORKER_METRICS_PORT)
+
+    await http_client.open_client()
+    try:
+        while True:
+            # Heartbeat the shards in progress and abandon those whose lease was taken over
+            for shard, task in list(running.items()):
+                if task.done():
+                    del running[shard]
+                elif not await _heartbeat(holder, shard):
+                    print(f"Worker {holder} lost the lease on weather alert sweep shard {shard}.")
+                    task.cancel()
+                    del running[shard]
+
+            # Claim due shards, in random order so that workers spread over different shards
+            for shard in random.sample(range(settings.SWEEP_SHARDS), settings.SWEEP_SHARDS):
+                if len(running) >= settings.SWEEP_MAX_SHARDS_PER_WORKER:
+                    break
+                if shard not in running and await _claim_shard(holder, shard):
+                    running[shard] = asyncio.create_task(_sweep_shard(holder, shard))
+
+            if rollup is None or rollup.done():
+                rollup = asyncio.create_task(_rollup_observations(holder))
+
+            await asyncio.sleep(settings.SWEEP_LEASE_RENEW_INTERVAL)
+    finally:
+        if rollup is not None:
+            rollup.cancel()
+        # Hand unfinished shards back so other workers can pick them up right away
+        for shard, task in running.items():
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+            await _release_shard(holder, shard, completed=False)
+        if metrics_server is not None:
+            metrics_server.close()
+        await http_client.close_client()
+        await database.async_engine.dispose()
+        mailer.close_pool()
+
+
+def main() -> None:
+    # Create the database tables
+    models.Base.metadata.create_all(bind=database.engine)
+    try:
+        asyncio.run(run())
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
+
+
+if __name__ == "__main__":
+    main()
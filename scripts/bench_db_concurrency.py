@@ -0,0 +1,110 @@
+"""
+Measure request throughput and event-loop stalls under parallel database load.
+
+Runs the same favorites query from many concurrent "requests" in one event loop, first with a
+synchronous Session called from the coroutine, as the routes did before the async migration,
+then with the app's AsyncSession. A SQLite function sleeps inside every query to stand in for
+database server time (--query-ms). A ticker measures how long the event loop is blocked, which
+is how long every other request on the process waits.
+
+    python scripts/bench_db_concurrency.py --requests 200 --concurrency 20 --query-ms 5
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def pause(seconds: float) -> int:
+    time.sleep(seconds)
+    return 0
+
+
+async def loop_stalls(stop: asyncio.Event, interval: float = 0.001) -> float:
+    worst = 0.0
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        worst = max(worst, time.perf_counter() - started - interval)
+    return worst
+
+
+async def run(label: str, request, requests: int, concurrency: int) -> None:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i: int):
+        async with semaphore:
+            await request(i % 50 + 1)
+
+    stop = asyncio.Event()
+    ticker = asyncio.create_task(loop_stalls(stop))
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    worst = await ticker
+    print(f"{label:>14}: {requests / elapsed:7.0f} requests/s, worst event-loop stall {worst * 1000:7.1f} ms")
+
+
+async def main(args) -> None:
+    from sqlalchemy import event, func, insert, select
+    from sqlalchemy.orm import sessionmaker
+
+    from app import database, models
+
+    delay = args.query_ms / 1000
+
+    for engine in (database.engine, database.async_engine.sync_engine):
+        @event.listens_for(engine, "connect")
+        def register_pause(dbapi_connection, _):
+            dbapi_connection.create_function("pause", 1, pause)
+
+    models.Base.metadata.create_all(database.engine)
+    with database.engine.begin() as connection:
+        connection.execute(insert(models.Users), [
+            {"id": i, "email": f"user{i}@example.com", "username": f"user{i}", "first_name": "A",
+             "last_name": "B", "hashed_password": "x", "is_active": True} for i in range(1, 51)])
+        connection.execute(insert(models.FavoriteLocation), [
+            {"name": f"City {i}", "latitude": 50.0 + i / 100, "longitude": i / 100, "owner_id": i % 50 + 1}
+            for i in range(500)])
+
+    def favorites(user_id: int):
+        # An uncorrelated scalar subquery, so the pause runs once per query rather than per row
+        return select(models.FavoriteLocation).where(models.FavoriteLocation.owner_id == user_id,
+                                                     select(func.pause(delay)).scalar_subquery() == 0)
+
+    SessionLocal = sessionmaker(bind=database.engine)
+
+    async def sync_request(user_id: int):
+        with SessionLocal() as db:
+            return db.scalars(favorites(user_id)).all()
+
+    async def async_request(user_id: int):
+        async with database.AsyncSessionLocal() as db:
+            return (await db.scalars(favorites(user_id))).all()
+
+    for label, request in (("sync Session", sync_request), ("AsyncSession", async_request)):
+        await request(1)  # open a connection first
+        await run(label, request, args.requests, args.concurrency)
+    await database.async_engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--query-ms", type=float, default=5.0)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), "bench.sqlite")
+    for name, value in {"API_KEY": "bench", "SECRET_KEY": "bench", "ALGORITHM": "HS256",
+                        "ACCESS_TOKEN_EXPIRE_MINUTES": "60", "EMAIL_FROM": "a@example.com", "SMTP_SERVER": "127.0.0.1",
+                        "SMTP_PORT": "2525", "SMTP_USER": "", "SMTP_PASSWORD": ""}.items():
+        os.environ.setdefault(name, value)
+    os.environ["DATABASE_URL"] = f"sqlite:///{path}"
+    os.environ.pop("ASYNC_DATABASE_URL", None)
+    asyncio.run(main(args))
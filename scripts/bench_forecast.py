@@ -0,0 +1,121 @@
+"""
+Compare will_it_rain_today on ForecastFrames with the previous per-entry implementation.
+
+Random 40-entry forecasts are first checked for identical results (volumes may differ by one
+rounding step, since entries are now summed in time order), then timed three ways: the legacy
+loop, building a frame and analysing it once, and analysing a frame that is already built (the
+cached case, where one frame serves rain-forecast, details and the summary).
+
+    python scripts/bench_forecast.py --forecasts 2000
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+for name, value in {"API_KEY": "bench", "DATABASE_URL": "sqlite:///:memory:", "SECRET_KEY": "bench",
+                    "ALGORITHM": "HS256", "ACCESS_TOKEN_EXPIRE_MINUTES": "60", "EMAIL_FROM": "a@example.com",
+                    "SMTP_SERVER": "127.0.0.1", "SMTP_PORT": "2525", "SMTP_USER": "", "SMTP_PASSWORD": ""}.items():
+    os.environ.setdefault(name, value)
+
+from app import upstream, utils  # noqa: E402
+from app.forecast import ForecastFrame  # noqa: E402
+
+
+def legacy_will_it_rain_today(forecast_data: dict):
+    """
+    will_it_rain_today as it was before ForecastFrame, working on the decoded JSON payload.
+    """
+    current_date = datetime.now().date()
+    rain_today = False
+    total_rain_volume = 0.0
+    rain_periods = []
+
+    for entry in forecast_data["list"]:
+        forecast_time = datetime.fromtimestamp(entry["dt"])
+        if forecast_time.date() == current_date:
+            for condition in entry["weather"]:
+                if "rain" in condition["description"].lower():
+                    rain_today = True
+                    total_rain_volume += entry["rain"].get("3h", 0.0)
+                    rain_periods.append((forecast_time, forecast_time + timedelta(hours=3)))
+                    break
+
+    combined_rain_periods = []
+    if rain_periods:
+        rain_periods.sort(key=lambda x: x[0])
+        current_start, current_end = rain_periods[0]
+        for start, end in rain_periods[1:]:
+            if start <= current_end:
+                current_end = max(current_end, end)
+            else:
+                combined_rain_periods.append((current_start, current_end))
+                current_start, current_end = start, end
+        combined_rain_periods.append((current_start, current_end))
+
+    formatted_rain_periods = [f"{start.strftime('%I:%M %p')} ({utils.categorize_time(start)}) - "
+                              f"{end.strftime('%I:%M %p')} ({utils.categorize_time(end)})"
+                              for start, end in combined_rain_periods]
+    return rain_today, round(total_rain_volume, 1), formatted_rain_periods
+
+
+def random_forecast(now: int) -> dict:
+    entries = []
+    for i in range(40):
+        rain = random.random() < 0.5
+        entries.append({
+            "dt": now - 3 * 10800 + i * 10800,
+            "main": {"temp": random.uniform(-5, 30)},
+            "wind": {"speed": random.uniform(0, 20)},
+            "weather": [{"id": 500 if rain else 800, "main": "Rain" if rain else "Clear",
+                         "description": "light rain" if rain else "clear sky"}],
+            "rain": {"3h": round(random.uniform(0, 3), 2)} if rain else {},
+        })
+    random.shuffle(entries)
+    return {"list": entries}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--forecasts", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    now = int(time.time()) // 10800 * 10800
+    payloads = [random_forecast(now) for _ in range(args.forecasts)]
+    forecasts = [upstream.forecast_decoder.decode(json.dumps(payload)) for payload in payloads]
+    frames = [ForecastFrame.from_forecast(forecast) for forecast in forecasts]
+
+    for payload, frame in zip(payloads, frames):
+        old, new = legacy_will_it_rain_today(payload), utils.will_it_rain_today(frame)
+        assert old[0] == new[0] and old[2] == new[2] and abs(old[1] - new[1]) <= 0.1001, (old, new)
+    print(f"{args.forecasts} forecasts give the same rain flag and periods")
+
+    started = time.perf_counter()
+    for payload in payloads:
+        legacy_will_it_rain_today(payload)
+    legacy = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for forecast in forecasts:
+        utils.will_it_rain_today(ForecastFrame.from_forecast(forecast))
+    built = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for frame in frames:
+        utils.will_it_rain_today(frame)
+    framed = time.perf_counter() - started
+
+    per_forecast = 1e6 / args.forecasts
+    print(f"    per-entry loop: {legacy:.3f}s ({legacy * per_forecast:.0f} us/forecast)")
+    print(f"build and analyse: {built:.3f}s ({built * per_forecast:.0f} us/forecast)")
+    print(f"  prebuilt frames: {framed:.3f}s ({framed * per_forecast:.0f} us/forecast)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+Measure how a burst of concurrent logins affects other requests on the same process.
+
+One client reads /weather/forecast-summary/London in a loop (served from cache, against a fake
+OpenWeatherMap API) while --logins logins run at once. Reports the page rate and latency, and the
+longest event-loop stall. --blocking runs bcrypt directly on the event loop, as logins did
+before the password thread pool, for comparison.
+
+    python scripts/bench_login_storm.py --logins 40
+    python scripts/bench_login_storm.py --logins 40 --blocking
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def fake_owm(request):
+    import httpx
+
+    if request.url.path.startswith("/geo"):
+        return httpx.Response(200, json=[{"lat": 51.5, "lon": -0.12}])
+    now = int(time.time()) // 10800 * 10800
+    return httpx.Response(200, json={"list": [
+        {"dt": now + i * 10800, "main": {"temp": 10 + i % 5}, "wind": {"speed": 2.0},
+         "weather": [{"id": 500, "main": "Rain", "description": "light rain"}], "rain": {"3h": 0.5}}
+        for i in range(40)]})
+
+
+async def run(logins: int, blocking: bool) -> None:
+    import httpx
+
+    from app import http_client
+    from app.routers import auth
+
+    http_client.create_client = lambda: httpx.AsyncClient(base_url="http://owm", transport=httpx.MockTransport(fake_owm))
+    from app.main import app
+
+    if blocking:
+        async def verify_and_update_password(plain_password, hashed_password):
+            return auth.bcrypt_context.verify_and_update(plain_password, hashed_password)
+
+        auth.verify_and_update_password = verify_and_update_password
+
+    stalls = []
+
+    async def ticker():
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(0.01)
+            stalls.append(time.perf_counter() - started - 0.01)
+
+    async def pages(client, seconds: float) -> list:
+        latencies = []
+        end = time.perf_counter() + seconds
+        while time.perf_counter() < end:
+            started = time.perf_counter()
+            response = await client.get("/weather/forecast-summary/London")
+            assert response.status_code == 200
+            latencies.append(time.perf_counter() - started)
+            await asyncio.sleep(0.005)
+        return latencies
+
+    def report(label: str, latencies: list, seconds: float) -> None:
+        latencies.sort()
+        print(f"{label}: {len(latencies) / seconds:4.0f} pages/s, page p50 {statistics.median(latencies) * 1000:.1f} ms, "
+              f"p95 {latencies[int(len(latencies) * 0.95)] * 1000:.1f} ms, "
+              f"longest loop stall {max(stalls) * 1000:.0f} ms")
+        stalls.clear()
+
+    async def login():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            response = await client.post("/auth/", data={"email": "storm", "password": "storm-password"})
+            assert response.status_code == 302
+
+    await http_client.open_client()
+    tick = asyncio.create_task(ticker())
+    try:
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            await client.post("/auth/register", data={
+                "email": "storm@example.com", "username": "storm", "firstname": "Storm", "lastname": "User",
+                "password": "storm-password", "password2": "storm-password"})
+            await client.get("/weather/forecast-summary/London")
+
+            stalls.clear()
+            report("idle", await pages(client, 2.0), 2.0)
+
+            started = time.perf_counter()
+            storm = asyncio.gather(*(login() for _ in range(logins)))
+            latencies = []
+            while not storm.done():
+                latencies += await pages(client, 0.1)
+            await storm
+            elapsed = time.perf_counter() - started
+            report(f"{logins} concurrent logins ({elapsed:.1f}s)", latencies, elapsed)
+    finally:
+        tick.cancel()
+        await http_client.close_client()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--logins", type=int, default=40)
+    parser.add_argument("--blocking", action="store_true", help="verify passwords on the event loop")
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), "bench.sqlite")
+    for name, value in {"API_KEY": "bench", "SECRET_KEY": "bench", "ALGORITHM": "HS256",
+                        "ACCESS_TOKEN_EXPIRE_MINUTES": "60", "EMAIL_FROM": "a@example.com", "SMTP_SERVER": "127.0.0.1",
+                        "SMTP_PORT": "2525", "SMTP_USER": "", "SMTP_PASSWORD": ""}.items():
+        os.environ.setdefault(name, value)
+    os.environ["DATABASE_URL"] = f"sqlite:///{path}"
+    os.environ.pop("ASYNC_DATABASE_URL", None)
+    os.chdir(ROOT)  # the app serves templates and static files relative to the repository root
+    asyncio.run(run(args.logins, args.blocking))
@@ -0,0 +1,110 @@
+"""
+Measure per-call latency of OpenWeatherMap requests against a local fake API server.
+
+Compares a new httpx.AsyncClient per call, as upstream calls were made before the shared
+client, with app.http_client.fetch over the shared keep-alive client (pointed at the fake
+server through OWM_BASE_URL).
+
+    python scripts/bench_owm_client.py --calls 500 --concurrency 10
+"""
+import argparse
+import asyncio
+import os
+import socket
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import uvicorn  # noqa: E402
+
+BODY = (b'{"id":2643743,"name":"London","dt":1700000000,"coord":{"lat":51.51,"lon":-0.13},'
+        b'"main":{"temp":12.3,"humidity":81,"pressure":1012},"weather":[{"id":500,"main":"Rain",'
+        b'"description":"light rain"}],"wind":{"speed":4.1},"clouds":{"all":75},"sys":{}}')
+
+
+async def fake_owm(scope, receive, send):
+    if scope["type"] != "http":
+        return
+    await send({"type": "http.response.start", "status": 200,
+                "headers": [(b"content-type", b"application/json")]})
+    await send({"type": "http.response.body", "body": BODY})
+
+
+def start_server() -> str:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(fake_owm, host="127.0.0.1", port=port, log_level="warning",
+                                           lifespan="off"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    return f"http://127.0.0.1:{port}"
+
+
+async def measure(call, calls: int, concurrency: int) -> list:
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            started = time.perf_counter()
+            response = await call()
+            latencies.append(time.perf_counter() - started)
+            assert response.status_code == 200
+
+    await asyncio.gather(*(one() for _ in range(calls)))
+    return latencies
+
+
+def report(label: str, latencies: list, elapsed: float) -> None:
+    latencies = sorted(latencies)
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    print(f"{label:>22}: p50 {statistics.median(latencies) * 1000:6.2f} ms, p95 {p95 * 1000:6.2f} ms, "
+          f"{len(latencies) / elapsed:6.0f} calls/s")
+
+
+async def run(base_url: str, calls: int, concurrency: int) -> None:
+    import httpx
+    from app import http_client
+
+    params = {"lat": 51.51, "lon": -0.13, "appid": "bench", "units": "metric"}
+
+    async def client_per_call():
+        async with httpx.AsyncClient() as client:
+            return await client.get(f"{base_url}/data/2.5/weather", params=params)
+
+    async def shared_client():
+        return await http_client.fetch("/data/2.5/weather", params=params)
+
+    await http_client.open_client()
+    try:
+        for label, call in (("client per call", client_per_call), ("shared client", shared_client)):
+            await measure(call, min(calls, 20), concurrency)  # warm up
+            started = time.perf_counter()
+            latencies = await measure(call, calls, concurrency)
+            report(label, latencies, time.perf_counter() - started)
+    finally:
+        await http_client.close_client()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--calls", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=1)
+    args = parser.parse_args()
+
+    base_url = start_server()
+    for name, value in {"API_KEY": "bench", "DATABASE_URL": "sqlite:///:memory:", "SECRET_KEY": "bench",
+                        "ALGORITHM": "HS256", "ACCESS_TOKEN_EXPIRE_MINUTES": "60", "EMAIL_FROM": "a@example.com",
+                        "SMTP_SERVER": "127.0.0.1", "SMTP_PORT": "2525", "SMTP_USER": "", "SMTP_PASSWORD": ""}.items():
+        os.environ.setdefault(name, value)
+    os.environ["OWM_BASE_URL"] = base_url
+    asyncio.run(run(base_url, args.calls, args.concurrency))
+
+
+if __name__ == "__main__":
+    main()
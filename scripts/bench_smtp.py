@@ -0,0 +1,105 @@
+"""
+Measure alert email throughput against a local SMTP server (aiosmtpd).
+
+Compares opening one SMTP connection per message, as alerts were sent before the connection
+pool, with SMTPPool.send_each. --rtt delays every SMTP command on the server side to stand in
+for the network round-trip to a real provider.
+
+    python scripts/bench_smtp.py --messages 500 --rtt 0.01 --pool-size 4
+"""
+import argparse
+import asyncio
+import os
+import smtplib
+import socket
+import sys
+import time
+from email.message import EmailMessage
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+for name, value in {"API_KEY": "bench", "DATABASE_URL": "sqlite:///:memory:", "SECRET_KEY": "bench",
+                    "ALGORITHM": "HS256", "ACCESS_TOKEN_EXPIRE_MINUTES": "60", "EMAIL_FROM": "alerts@example.com",
+                    "SMTP_SERVER": "127.0.0.1", "SMTP_PORT": "2525", "SMTP_USER": "", "SMTP_PASSWORD": ""}.items():
+    os.environ.setdefault(name, value)
+
+from aiosmtpd.controller import Controller  # noqa: E402
+
+from app.mailer import SMTPPool  # noqa: E402
+
+
+class Handler:
+    def __init__(self, rtt: float):
+        self.rtt = rtt
+        self.delivered = 0
+
+    async def handle_EHLO(self, server, session, envelope, hostname, responses):
+        await asyncio.sleep(self.rtt)
+        session.host_name = hostname
+        return responses
+
+    async def handle_MAIL(self, server, session, envelope, address, mail_options):
+        await asyncio.sleep(self.rtt)
+        envelope.mail_from = address
+        return "250 OK"
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        await asyncio.sleep(self.rtt)
+        envelope.rcpt_tos.append(address)
+        return "250 OK"
+
+    async def handle_DATA(self, server, session, envelope):
+        await asyncio.sleep(self.rtt)
+        self.delivered += 1
+        return "250 Message accepted for delivery"
+
+
+def message(i: int) -> EmailMessage:
+    msg = EmailMessage()
+    msg["From"] = "alerts@example.com"
+    msg["To"] = f"user{i}@example.com"
+    msg["Subject"] = "Severe Weather Alert for London!"
+    msg.set_content("Dear user,\n\nSevere weather conditions are expected in London.\n")
+    return msg
+
+
+def send_per_connection(port: int, messages) -> None:
+    for msg in messages:
+        with smtplib.SMTP("127.0.0.1", port) as server:
+            server.send_message(msg)
+
+
+def send_pooled(port: int, messages, size: int) -> None:
+    pool = SMTPPool("127.0.0.1", port, "", "", size=size, starttls=False)
+    try:
+        assert all(pool.send_each(messages))
+    finally:
+        pool.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--messages", type=int, default=500)
+    parser.add_argument("--rtt", type=float, default=0.0, help="seconds added to every SMTP command")
+    parser.add_argument("--pool-size", type=int, default=2)
+    args = parser.parse_args()
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    handler = Handler(args.rtt)
+    controller = Controller(handler, hostname="127.0.0.1", port=port)
+    controller.start()
+    try:
+        messages = [message(i) for i in range(args.messages)]
+        for label, run in (("connection per message", lambda: send_per_connection(port, messages)),
+                           (f"pool of {args.pool_size}", lambda: send_pooled(port, messages, args.pool_size))):
+            started = time.perf_counter()
+            run()
+            elapsed = time.perf_counter() - started
+            print(f"{label:>24}: {args.messages} messages in {elapsed:.2f}s = {args.messages / elapsed:.0f} msg/s")
+    finally:
+        controller.stop()
+
+
+if __name__ == "__main__":
+    main()
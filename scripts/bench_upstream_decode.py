@@ -0,0 +1,63 @@
+"""
+Compare decoding an OpenWeatherMap 5-day forecast with json.loads and with the msgspec structs
+in app/upstream.py: time per decode, and memory held by the decoded result.
+
+    python scripts/bench_upstream_decode.py --runs 5000
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import upstream  # noqa: E402
+
+
+def forecast_payload(now: int = 1760000000) -> bytes:
+    """
+    A forecast body shaped like the real API's, including the fields the app does not use.
+    """
+    return json.dumps({
+        "cod": "200", "message": 0, "cnt": 40,
+        "list": [{
+            "dt": now + i * 10800,
+            "main": {"temp": 10.5, "feels_like": 9.1, "temp_min": 9, "temp_max": 11, "pressure": 1012,
+                     "sea_level": 1012, "grnd_level": 1008, "humidity": 80, "temp_kf": 0},
+            "weather": [{"id": 500, "main": "Rain", "description": "light rain", "icon": "10d"}],
+            "clouds": {"all": 90}, "wind": {"speed": 4.1, "deg": 200, "gust": 7.2}, "visibility": 10000,
+            "pop": 0.6, "rain": {"3h": 0.4}, "sys": {"pod": "d"}, "dt_txt": "2026-10-18 12:00:00",
+        } for i in range(40)],
+        "city": {"id": 1, "name": "London", "coord": {"lat": 51.5, "lon": -0.12}, "country": "GB",
+                 "population": 1, "timezone": 0, "sunrise": 1, "sunset": 2},
+    }).encode()
+
+
+def retained_bytes(decode, payload: bytes) -> int:
+    tracemalloc.start()
+    result = decode(payload)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del result
+    return size
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--runs", type=int, default=5000)
+    args = parser.parse_args()
+
+    payload = forecast_payload()
+    print(f"payload: {len(payload)} bytes")
+    for label, decode in (("json.loads", json.loads), ("msgspec decode", upstream.forecast_decoder.decode)):
+        started = time.perf_counter()
+        for _ in range(args.runs):
+            decode(payload)
+        per_call = (time.perf_counter() - started) / args.runs
+        print(f"{label:>15}: {per_call * 1e6:6.1f} us per decode, {retained_bytes(decode, payload) / 1024:5.1f} KB retained")
+
+
+if __name__ == "__main__":
+    main()
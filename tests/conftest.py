@@ -0,0 +1,16 @@
+import os
+
+# app.config requires these; tests never talk to the real services
+for name, value in {
+    "API_KEY": "test",
+    "DATABASE_URL": "sqlite:///:memory:",
+    "SECRET_KEY": "test",
+    "ALGORITHM": "HS256",
+    "ACCESS_TOKEN_EXPIRE_MINUTES": "60",
+    "EMAIL_FROM": "alerts@example.com",
+    "SMTP_SERVER": "127.0.0.1",
+    "SMTP_PORT": "2525",
+    "SMTP_USER": "",
+    "SMTP_PASSWORD": "",
+}.items():
+    os.environ.setdefault(name, value)
@@ -0,0 +1,183 @@
+import smtplib
+import socket
+from email.message import EmailMessage
+
+import pytest
+from aiosmtpd.controller import Controller
+
+from app import mailer
+
+
+class Handler:
+    """
+    aiosmtpd handler that answers DATA with queued replies before accepting, and can refuse recipients.
+    """
+
+    def __init__(self):
+        self.delivered = []
+        self.data_replies = []
+        self.data_attempts = 0
+        self.refuse_recipients = False
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if self.refuse_recipients:
+            return "550 No such user here"
+        envelope.rcpt_tos.append(address)
+        return "250 OK"
+
+    async def handle_DATA(self, server, session, envelope):
+        self.data_attempts += 1
+        if self.data_replies:
+            return self.data_replies.pop(0)
+        self.delivered.append(envelope.rcpt_tos[0])
+        return "250 Message accepted for delivery"
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def server():
+    handler = Handler()
+    controller = Controller(handler, hostname="127.0.0.1", port=free_port())
+    controller.start()
+    yield controller
+    controller.stop()
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    delays = []
+    monkeypatch.setattr(mailer.time, "sleep", delays.append)
+    return delays
+
+
+def make_pool(port: int, **kwargs) -> mailer.SMTPPool:
+    options = dict(size=2, starttls=False, timeout=5.0, max_retries=3, backoff=0.1)
+    options.update(kwargs)
+    pool = mailer.SMTPPool("127.0.0.1", port, "", "", **options)
+    connects = []
+    connect = pool._connect
+
+    def counting_connect():
+        connects.append(1)
+        return connect()
+
+    pool._connect = counting_connect
+    pool.connects = connects
+    return pool
+
+
+def message(to: str = "user@example.com") -> EmailMessage:
+    msg = EmailMessage()
+    msg["From"] = "alerts@example.com"
+    msg["To"] = to
+    msg["Subject"] = "Severe Weather Alert"
+    msg.set_content("Stay safe.")
+    return msg
+
+
+def test_reuses_pooled_connection(server):
+    pool = make_pool(server.port)
+    for _ in range(5):
+        pool.send(message())
+    pool.close()
+
+    assert len(server.handler.delivered) == 5
+    assert len(pool.connects) == 1
+
+
+def test_send_each_reports_every_message(server):
+    pool = make_pool(server.port)
+    server.handler.refuse_recipients = False
+    outcomes = pool.send_each([message(f"user{i}@example.com") for i in range(10)])
+    pool.close()
+
+    assert outcomes == [True] * 10
+    assert sorted(server.handler.delivered) == sorted(f"user{i}@example.com" for i in range(10))
+    assert len(pool.connects) <= pool.size
+
+
+def test_stale_connection_is_replaced(server, sleeps):
+    pool = make_pool(server.port)
+    pool.send(message())
+
+    # The server has dropped the idle connection, as it would after its idle timeout
+    stale = pool._idle.queue[0]
+    stale.sock.shutdown(socket.SHUT_RDWR)
+    pool.send(message())
+    pool.close()
+
+    assert len(server.handler.delivered) == 2
+    assert len(pool.connects) == 2
+    assert sleeps == [0.1]
+
+
+def test_temporary_failure_is_retried_with_backoff(server, sleeps):
+    server.handler.data_replies = ["451 Try again later", "421 Service not available"]
+    pool = make_pool(server.port)
+    pool.send(message())
+    pool.close()
+
+    assert server.handler.data_attempts == 3
+    assert len(server.handler.delivered) == 1
+    assert sleeps == [0.1, 0.2]
+
+
+def test_gives_up_after_max_retries(server, sleeps):
+    server.handler.data_replies = ["451 Try again later"] * 10
+    pool = make_pool(server.port, max_retries=2)
+
+    with pytest.raises(smtplib.SMTPDataError):
+        pool.send(message())
+
+    assert server.handler.data_attempts == 3
+    assert sleeps == [0.1, 0.2]
+
+
+def test_permanent_failure_is_not_retried(server, sleeps):
+    server.handler.data_replies = ["554 Message rejected"]
+    pool = make_pool(server.port)
+
+    with pytest.raises(smtplib.SMTPDataError):
+        pool.send(message())
+
+    assert server.handler.data_attempts == 1
+    assert sleeps == []
+
+
+def test_refused_recipients_are_not_retried(server, sleeps):
+    server.handler.refuse_recipients = True
+    pool = make_pool(server.port)
+
+    with pytest.raises(smtplib.SMTPRecipientsRefused):
+        pool.send(message())
+
+    assert sleeps == []
+    assert len(pool.connects) == 1
+
+
+def test_send_each_reports_failures(server, sleeps):
+    server.handler.data_replies = ["554 Message rejected"]
+    pool = make_pool(server.port, size=1)
+    outcomes = pool.send_each([message("a@example.com"), message("b@example.com")])
+    pool.close()
+
+    assert outcomes == [False, True]
+
+
+def test_slots_are_released_when_connect_fails(sleeps):
+    port = free_port()
+    pool = make_pool(port, size=1, max_retries=1)
+
+    # Nothing listens on the port, so every connect is refused; the slot must come back each time
+    for _ in range(3):
+        with pytest.raises(ConnectionRefusedError):
+            pool.send(message())
+
+    assert len(pool.connects) == 6
+    assert sleeps == [0.1] * 3
+    assert pool._slots.acquire(blocking=False)